@@ -0,0 +1,220 @@
+import argparse
+import time
+
+import numpy as np
+
+import sweep
+from pong import SCREEN_SIZE, MIDDLE, MARGIN, BAT_SIZE, BAT_SPEED, BALL_SIZE, BALL_SPEED, WALLS, intercept_y
+
+# Arrays with one entry per match
+STATE = ("ball_x", "ball_y", "ball_vx", "ball_vy", "bat_left_y", "bat_right_y", "score_left", "score_right")
+
+
+class BatchPong():
+    """Many pong matches stepped together on NumPy arrays
+
+    Every match follows the rules of pong.Match.step: bats move first,
+    a ball outside the screen scores and is reset, and the ball then moves
+    along its path, bouncing off the walls and bats like sweep.bounce.
+
+    Positions are the top-left corners of the ball and bat rects, ball
+    positions are floats and the ball rect is their rounded value.
+    """
+
+    def __init__(self, n_matches, seed=None):
+        self.n_matches = n_matches
+        self.rng = np.random.default_rng(seed)
+
+        self.ball_x = np.zeros(n_matches, dtype=np.float64)
+        self.ball_y = np.zeros(n_matches, dtype=np.float64)
+        self.ball_vx = np.zeros(n_matches, dtype=np.float64)
+        self.ball_vy = np.zeros(n_matches, dtype=np.float64)
+
+        self.bat_left_x = MARGIN
+        self.bat_right_x = SCREEN_SIZE.width - MARGIN - BAT_SIZE.width
+        self.bat_left_y = np.full(n_matches, MIDDLE.y, dtype=np.int64)
+        self.bat_right_y = np.full(n_matches, MIDDLE.y, dtype=np.int64)
+
+        self.score_left = np.zeros(n_matches, dtype=np.int64)
+        self.score_right = np.zeros(n_matches, dtype=np.int64)
+        self.frame = 0
+
+        self.reset_balls()
+
+    def reset(self, mask=None):
+        """Start the selected matches (default: all) over, with no points and the bats in their start position"""
+        if mask is None:
+            mask = np.ones(self.n_matches, dtype=bool)
+        self.bat_left_y[mask] = MIDDLE.y
+        self.bat_right_y[mask] = MIDDLE.y
+        self.score_left[mask] = 0
+        self.score_right[mask] = 0
+        self.reset_balls(mask)
+
+    def reset_balls(self, mask=None):
+        """Put the balls of the selected matches (default: all) in the middle with a random direction"""
+        if mask is None:
+            mask = np.ones(self.n_matches, dtype=bool)
+        n = int(np.count_nonzero(mask))
+        if n == 0:
+            return
+
+        self.ball_x[mask] = MIDDLE.x - BALL_SIZE.width // 2
+        self.ball_y[mask] = MIDDLE.y - BALL_SIZE.height // 2
+
+        # Same distribution as Ball.set_random_direction
+        sign = self.rng.choice((-1, 1), size=n)
+        angle = np.radians(self.rng.integers(-60, 60, size=n, endpoint=True))
+        self.ball_vx[mask] = sign * BALL_SPEED * np.cos(angle)
+        self.ball_vy[mask] = sign * BALL_SPEED * np.sin(angle)
+
+    def _move_bats(self, bat_y, up, down):
+        if up is not None:
+            np.subtract(bat_y, BAT_SPEED, out=bat_y, where=np.asarray(up, dtype=bool) & (bat_y > 0))
+        if down is not None:
+            np.add(bat_y, BAT_SPEED, out=bat_y,
+                where=np.asarray(down, dtype=bool) & (bat_y + BAT_SIZE.height < SCREEN_SIZE.height))
+
+    def _move_balls(self):
+        """Vectorized sweep.bounce of every ball against the walls and both bats"""
+        n_walls = len(WALLS)
+        target_x = np.array([wall.x for wall in WALLS] + [self.bat_left_x, self.bat_right_x], dtype=np.float64)
+        target_y = np.empty((self.n_matches, n_walls + 2))
+        target_y[:, :n_walls] = [wall.y for wall in WALLS]
+        target_y[:, n_walls] = self.bat_left_y
+        target_y[:, n_walls + 1] = self.bat_right_y
+        target_width = np.array([wall.width for wall in WALLS] + [BAT_SIZE.width] * 2, dtype=np.float64)
+        target_height = np.array([wall.height for wall in WALLS] + [BAT_SIZE.height] * 2, dtype=np.float64)
+
+        sweep.bounce_many(self.ball_x, self.ball_y, *BALL_SIZE, self.ball_vx, self.ball_vy,
+            (target_x, target_y, target_width, target_height))
+
+    def step(self, left_up=None, left_down=None, right_up=None, right_down=None, mask=None):
+        """Advance every match, or the matches selected by a boolean mask, by one frame
+
+        Inputs are boolean arrays with one entry per match, or None for
+        keys that are not held in any match. Return two boolean arrays
+        telling in which matches the left and the right player scored.
+        Stepping a few selected matches costs about as much as a batch of
+        only those matches, not of all of them.
+        """
+        if mask is not None:
+            index = np.flatnonzero(mask)
+            part = self.take(index)
+            scored = part.step(*(None if keys is None else np.asarray(keys)[index] for keys in (left_up, left_down, right_up, right_down)))
+            self.put(index, part)
+            self.frame += 1
+            scored_left, scored_right = np.zeros(self.n_matches, dtype=bool), np.zeros(self.n_matches, dtype=bool)
+            scored_left[index], scored_right[index] = scored
+            return scored_left, scored_right
+
+        self._move_bats(self.bat_left_y, left_up, left_down)
+        self._move_bats(self.bat_right_y, right_up, right_down)
+
+        rect_x = np.round(self.ball_x)
+        scored_right = rect_x <= 0
+        scored_left = ~scored_right & (rect_x + BALL_SIZE.width >= SCREEN_SIZE.width)
+        self.score_right += scored_right
+        self.score_left += scored_left
+        self.reset_balls(scored_left | scored_right)
+
+        self._move_balls()
+
+        self.frame += 1
+        return scored_left, scored_right
+
+    def take(self, index):
+        """Return a BatchPong of copies of the matches at an array of indices, sharing the random numbers"""
+        part = BatchPong.__new__(BatchPong)
+        part.n_matches = len(index)
+        part.rng = self.rng
+        part.bat_left_x, part.bat_right_x = self.bat_left_x, self.bat_right_x
+        part.frame = self.frame
+        for name in STATE:
+            setattr(part, name, getattr(self, name)[index])
+        return part
+
+    def put(self, index, part):
+        """Copy the matches of a BatchPong made by take() back to their indices"""
+        for name in STATE:
+            getattr(self, name)[index] = getattr(part, name)
+
+    def load_match(self, index, match):
+        """Copy the state of a pong.Match into one slot of the batch"""
+        self.ball_x[index], self.ball_y[index] = match.ball.position
+        self.ball_vx[index], self.ball_vy[index] = match.ball.movement
+        self.bat_left_y[index] = match.bat_left.rect.top
+        self.bat_right_y[index] = match.bat_right.rect.top
+        self.score_left[index] = match.scoreboard.score_left
+        self.score_right[index] = match.scoreboard.score_right
+
+
+def follow_ball(batch):
+    """Return the (up, down) inputs of a ball-following bot for both sides of every match"""
+    ball_center = np.round(batch.ball_y) + BALL_SIZE.height // 2
+    left_center = batch.bat_left_y + BAT_SIZE.height // 2
+    right_center = batch.bat_right_y + BAT_SIZE.height // 2
+    return ball_center < left_center, ball_center > left_center, ball_center < right_center, ball_center > right_center
+
+
+class BatchCPU():
+    """pong.CPUController for one side of every match of a BatchPong
+
+    Predictions are only worked out again for the matches in which the
+    ball's movement changed, so it costs a few array operations per frame.
+    """
+
+    def __init__(self, batch, side="right", reaction_delay=0, error=0, seed=None):
+        self.side = side
+        self.reaction_delay = reaction_delay
+        self.error = error
+        self.rng = np.random.default_rng(seed)
+        self.movement_x = np.full(batch.n_matches, np.nan)
+        self.movement_y = np.full(batch.n_matches, np.nan)
+        self.target = np.full(batch.n_matches, float(MIDDLE.y))
+        self.pending_target = np.full(batch.n_matches, float(MIDDLE.y))
+        self.pending_frame = np.zeros(batch.n_matches, dtype=np.int64)
+
+    def __call__(self, batch):
+        """Return the (up, down) inputs of this side for every match"""
+        changed = (batch.ball_vx != self.movement_x) | (batch.ball_vy != self.movement_y)
+        if changed.any():
+            self.movement_x[changed] = batch.ball_vx[changed]
+            self.movement_y[changed] = batch.ball_vy[changed]
+            self.pending_target[changed] = self.predict(batch, changed)
+            self.pending_frame[changed] = batch.frame + self.reaction_delay
+        react = self.pending_frame == batch.frame
+        self.target[react] = self.pending_target[react]
+
+        bat_y = batch.bat_left_y if self.side == "left" else batch.bat_right_y
+        offset = self.target - (bat_y + BAT_SIZE.height // 2)
+        return offset < -BAT_SPEED / 2, offset > BAT_SPEED / 2
+
+    def predict(self, batch, mask):
+        dx, dy = batch.ball_vx[mask], batch.ball_vy[mask]
+        if self.side == "left":
+            edge_x, face_x = batch.ball_x[mask], batch.bat_left_x + BAT_SIZE.width
+        else:
+            edge_x, face_x = batch.ball_x[mask] + BALL_SIZE.width, batch.bat_right_x
+        with np.errstate(divide="ignore", invalid="ignore"):
+            arriving = (face_x - edge_x) / dx >= 0
+            y = intercept_y(edge_x, batch.ball_y[mask], dx, dy, face_x)
+        error = self.rng.uniform(-self.error, self.error, size=len(dx)) if self.error else 0
+        return np.where(arriving, y + BALL_SIZE.height / 2 + error, MIDDLE.y)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Step many headless pong matches at once")
+    parser.add_argument("--matches", type=int, default=10000)
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    batch = BatchPong(args.matches, seed=args.seed)
+    start = time.perf_counter()
+    for _ in range(args.frames):
+        batch.step(*follow_ball(batch))
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.matches * args.frames / elapsed:,.0f} match frames per second")
+    print(f"points scored: {int(batch.score_left.sum() + batch.score_right.sum())}")
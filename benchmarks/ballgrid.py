@@ -0,0 +1,62 @@
+import argparse
+import random
+import statistics
+import time
+
+from colorpong import BallGrid, Ball, BALL_COLORS, EMPTY
+
+
+def fill(grid, n_rows, n_colors, rng):
+    """Fill the top rows of the grid with random colors"""
+    for row in range(n_rows):
+        for col in range(grid.n_columns):
+            if grid.colors[row, col] == EMPTY:
+                color = rng.choice(BALL_COLORS[:n_colors])
+                grid.place(row, col, Ball(grid.center_points[(row, col)], color))
+
+
+def shoot(grid, rng, n_colors):
+    """Land a random ball under the lowest ball of a random column, return the time it took"""
+    col = rng.randrange(grid.n_columns)
+    occupied = (grid.colors[:, col] != EMPTY).nonzero()[0]
+    row = occupied[-1] + 1 if len(occupied) else 0
+    if row >= grid.n_rows:
+        return None
+    ball = Ball(grid.center_points[(row, col)], rng.choice(BALL_COLORS[:n_colors]))
+
+    start = time.perf_counter()
+    grid.add_ball_hit(ball, row, col)
+    return time.perf_counter() - start
+
+
+def run(n_rows, n_shots, n_colors, seed):
+    rng = random.Random(seed)
+    random.seed(seed)
+    grid = BallGrid(n_rows)
+    fill(grid, n_rows // 2, n_colors, rng)
+
+    timings = []
+    while len(timings) < n_shots:
+        if len(grid.matrix) < grid.n_columns * n_rows // 4:
+            fill(grid, n_rows // 2, n_colors, rng)
+        elapsed = shoot(grid, rng, n_colors)
+        if elapsed is not None:
+            timings.append(elapsed)
+    return grid, timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the cost of landing a ball on colorpong boards of growing size")
+    parser.add_argument("--rows", type=int, nargs="+", default=[22, 100, 400])
+    parser.add_argument("--shots", type=int, default=2000)
+    parser.add_argument("--colors", type=int, default=3, help="number of colors in play, fewer colors means more matches")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'rows':>6} {'cells':>7} {'mean us':>9} {'median us':>10} {'p99 us':>9} {'max us':>9}")
+    for n_rows in args.rows:
+        grid, timings = run(n_rows, args.shots, args.colors, args.seed)
+        timings = sorted(t * 1E6 for t in timings)
+        p99 = timings[int(len(timings) * 0.99) - 1]
+        print(f"{n_rows:>6} {grid.colors.size:>7} {statistics.mean(timings):>9.1f} "
+            f"{statistics.median(timings):>10.1f} {p99:>9.1f} {timings[-1]:>9.1f}")
@@ -0,0 +1,182 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import argparse
+import cProfile
+import json
+import pstats
+import random
+import statistics
+import sys
+import time
+
+import pygame as pg
+
+import boxpong
+import colorpong
+import pong
+
+PHASES = ("input", "logic", "render")
+
+
+def read_events():
+    """Poll pygame like the game loops do, the scripted inputs replace the results"""
+    pg.event.get()
+    pg.key.get_pressed()
+
+
+def pong_scenario(rng):
+    """Two ball-following bots, the right one with a sloppy aim"""
+    match = pong.Match()
+    aim = 0
+
+    def read_input(frame):
+        nonlocal aim
+        read_events()
+        if frame % 30 == 0:
+            aim = rng.randint(-120, 120)
+        left_up, left_down = pong.follow_ball(match, match.bat_left)
+        target = match.ball.rect.centery + aim
+        return left_up, left_down, target < match.bat_right.rect.centery, target > match.bat_right.rect.centery
+
+    return read_input, lambda inputs: match.step(*inputs), match.draw
+
+
+def boxpong_scenario(rng):
+    """A bat that follows the ball, with a multiball every 600 frames"""
+    game = boxpong.Game()
+    menu_image = boxpong.Menu().get_image()
+    previous = (False, False)
+
+    def read_input(frame):
+        nonlocal previous
+        read_events()
+        offset = rng.randint(-60, 60)
+        left = game.ball.rect.centerx + offset < game.bat.rect.centerx
+        right = game.ball.rect.centerx + offset > game.bat.rect.centerx
+        release = (previous[0] and not left) or (previous[1] and not right)
+        previous = (left, right)
+        return left, right, frame % 120 == 0, release, frame % 600 == 60
+
+    def draw(screen, background):
+        game.draw(screen, background, menu_image)
+
+    return read_input, lambda inputs: game.step(*inputs), draw
+
+
+def colorpong_scenario(rng):
+    """A nozzle that sweeps from side to side and shoots every 15 frames"""
+    game = colorpong.Game()
+    direction = 0
+
+    def read_input(frame):
+        nonlocal direction
+        read_events()
+        if frame % 20 == 0:
+            direction = rng.choice((-1, 0, 1))
+        return direction < 0, direction > 0, frame % 15 == 0
+
+    return read_input, lambda inputs: game.step(*inputs), game.draw
+
+
+SCENARIOS = {
+    "pong": pong_scenario,
+    "boxpong": boxpong_scenario,
+    "colorpong": colorpong_scenario,
+}
+
+
+def run(name, frames, seed, profiler=None):
+    """Play a scenario and return the per-frame time of every phase in microseconds"""
+    rng = random.Random(seed)
+    random.seed(seed)
+    read_input, update, draw = SCENARIOS[name](rng)
+
+    screen = pg.display.get_surface()
+    background = pg.Surface(screen.get_size()).convert()
+    background.fill(pg.Color("black"))
+
+    timings = {phase: [] for phase in PHASES}
+    clock = time.perf_counter
+    for frame in range(frames):
+        start = clock()
+        inputs = read_input(frame)
+        input_done = clock()
+        if profiler is not None:
+            profiler.enable()
+        update(inputs)
+        if profiler is not None:
+            profiler.disable()
+        logic_done = clock()
+        draw(screen, background)
+        pg.display.flip()
+        render_done = clock()
+
+        timings["input"].append((input_done - start) * 1E6)
+        timings["logic"].append((logic_done - input_done) * 1E6)
+        timings["render"].append((render_done - logic_done) * 1E6)
+    return timings
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "mean": statistics.mean(samples),
+        "median": statistics.median(samples),
+        "p95": samples[int(len(samples) * 0.95) - 1],
+        "max": samples[-1],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return the (game, phase, baseline, current) medians that got slower than the tolerance allows"""
+    regressions = []
+    for name, phases in results.items():
+        for phase, summary in phases.items():
+            old = baseline.get(name, {}).get(phase)
+            if old is not None and summary["median"] > old["median"] * (1 + tolerance):
+                regressions.append((name, phase, old["median"], summary["median"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time input, logic and rendering of every game with scripted inputs")
+    parser.add_argument("games", nargs="*", default=list(SCENARIOS), help=f"games to run, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--frames", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", metavar="FILE", help="store the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results with a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown of a median before it counts as a regression")
+    parser.add_argument("--profile", action="store_true", help="print the functions that take the most logic time")
+    args = parser.parse_args()
+    for name in args.games:
+        if name not in SCENARIOS:
+            parser.error(f"unknown game {name!r}")
+
+    pg.display.init()
+    pg.font.init()
+    pg.display.set_mode(boxpong.SCREEN_SIZE)
+
+    results = {}
+    print(f"{'game':<10} {'phase':<7} {'mean us':>9} {'median us':>10} {'p95 us':>9} {'max us':>9}")
+    for name in args.games:
+        profiler = cProfile.Profile() if args.profile else None
+        timings = run(name, args.frames, args.seed, profiler)
+        results[name] = {phase: summarize(samples) for phase, samples in timings.items()}
+        for phase, s in results[name].items():
+            print(f"{name:<10} {phase:<7} {s['mean']:>9.1f} {s['median']:>10.1f} {s['p95']:>9.1f} {s['max']:>9.1f}")
+        if profiler is not None:
+            pstats.Stats(profiler).sort_stats("tottime").print_stats(10)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, phase, old, new in regressions:
+            print(f"REGRESSION {name} {phase}: median {old:.1f} us -> {new:.1f} us")
+        if regressions:
+            sys.exit(1)
@@ -1,8 +1,18 @@
 import pygame as pg
+import numpy as np
+import argparse
+import functools
+import itertools
+import math
+import os
+import random
 from collections import namedtuple
 
-Position = namedtuple("Position", "x y")
-Size = namedtuple("Size", "width height")
+import sweep
+from engine import Bodies, Entity, EntityGroup, Position, Size, add_common_arguments, open_game
+from levels import HARD, NORMAL, STEEL, LevelPack, LevelStream, make_grid_level
+from rendercache import blit_all, get_font, prepare_surface, render_text
+from timestep import interpolate, snapshot
 
 GAME_TITLE = "Boxpong"
 
@@ -20,6 +30,9 @@ BALL_SIZE = Size(20, 20)
 BALL_SPEED_FACTOR = 0.5  # Multiplier for ball speed when it collides with the bat
 DEFAULT_BALL_SPEED = 7
 
+MULTIBALL_COUNT = 200  # Balls spawned by the multiball power-up
+MULTIBALL_SPREAD = 60  # Largest angle in degrees between a new ball and straight up
+
 BOX_SIZE = Size(120, 50)
 BOX_PADDING = 5
 N_ROW = 5
@@ -32,57 +45,225 @@ TEXT_PADDING = 20
 
 BLACK = pg.Color("black")
 WHITE = pg.Color("white")
+BOX_COLORS = {NORMAL: WHITE, HARD: pg.Color("gray60"), STEEL: pg.Color("steelblue")}
+
+# Solid areas above, left and right of the screen that the ball bounces off
+WALLS = (
+    sweep.Box(-SCREEN_SIZE.width, -SCREEN_SIZE.height, 3 * SCREEN_SIZE.width, SCREEN_SIZE.height),
+    sweep.Box(-SCREEN_SIZE.width, -SCREEN_SIZE.height, SCREEN_SIZE.width, 3 * SCREEN_SIZE.height),
+    sweep.Box(SCREEN_SIZE.width, -SCREEN_SIZE.height, SCREEN_SIZE.width, 3 * SCREEN_SIZE.height),
+)
+
+
+@functools.lru_cache(maxsize=None)
+def get_ball_image():
+    """Return the image shared by the ball and all multiballs"""
+    image = pg.Surface(BALL_SIZE)
+    pg.draw.circle(surface=image, color=WHITE, center=(BALL_SIZE.width // 2, BALL_SIZE.height // 2), radius=BALL_SIZE.width // 2)
+    return prepare_surface(image, colorkey=BLACK)
+
 
+@functools.lru_cache(maxsize=None)
+def get_box_image(box_type=NORMAL, size=BOX_SIZE):
+    """Return the image shared by all boxes of a type and size"""
+    image = pg.Surface(size)
+    image.fill(BOX_COLORS[box_type])
+    return prepare_surface(image)
+
+
+class Ball(Entity):
+    __slots__ = ("position", "movement")
 
-class Ball(pg.sprite.Sprite):
     def __init__(self):
-        pg.sprite.Sprite.__init__(self)
-        self.image = pg.Surface(BALL_SIZE)
-        self.rect = pg.draw.circle(surface=self.image, color=WHITE, center=(BALL_SIZE.width // 2, BALL_SIZE.height // 2), radius=BALL_SIZE.width // 2)
+        Entity.__init__(self)
+        self.image = get_ball_image()
+        self.rect = self.image.get_rect()
         self.reset()
     
-    def move(self):
-        if self.rect.top <= 0:
-            self.movement.y = -self.movement.y
-        elif self.rect.left <= 0:
-            self.movement.x = -self.movement.x
-        elif self.rect.right >= SCREEN_SIZE.width:
-            self.movement.x = -self.movement.x
-        
-        self.rect.move_ip(self.movement.x, self.movement.y)
-    
-    def collide(self, bat):
-        if self.rect.colliderect(bat.rect):
-            self.movement.x += bat.speed * BALL_SPEED_FACTOR
-            self.movement.y = -self.movement.y
-    
-    def collide_box(self, box):
-        if self.rect.clipline(box.top_side) or self.rect.clipline(box.bottom_side):
-            self.movement.y = - self.movement.y
-        elif self.rect.clipline(box.left_side) or self.rect.clipline(box.right_side):
-            self.movement.x = - self.movement.x
+    def move(self, bat=None, boxes=None):
+        """Move the ball along its path, bouncing off walls, the bat and boxes
+
+        - Contacts are found along the whole path of the frame, so the ball
+          can not pass through thin boxes and bounces correctly off corners
+        - Hitting a moving bat transfers some of its speed to the ball
+        - Return the boxes that were hit, in the order they were hit
+        """
+        targets = list(WALLS)
+        if bat is not None:
+            targets.append(bat)
+        if boxes is not None:
+            # The ball can not leave this area within one frame
+            reach = math.ceil(self.movement.length()) + 1
+            targets.extend(boxes.get_boxes_in(self.rect.inflate(2 * reach, 2 * reach)))
+
+        hit_boxes = []
+        def respond(target, normal, movement):
+            movement = sweep.reflect(movement, normal)
+            if target is bat:
+                movement = (movement[0] + bat.speed * BALL_SPEED_FACTOR, movement[1])
+            elif isinstance(target, Box):
+                hit_boxes.append(target)
+                targets.remove(target)
+            return movement
+
+        (x, y), movement, _ = sweep.bounce((*self.position, *BALL_SIZE), self.movement, targets, respond)
+        self.movement.update(movement)
+        self.position.update(x, y)
+        self.rect.topleft = (round(x), round(y))
+        return hit_boxes
     
     def reset(self):
         self.rect.center = DEFAULT_BALL_POSITION
+        self.position = pg.math.Vector2(self.rect.topleft)
         self.movement = pg.math.Vector2((0, 0))
     
     def is_outside_screen(self):
         return self.rect.top >= SCREEN_SIZE.height
 
 
-class Box(pg.sprite.Sprite):
-    def __init__(self, position):
-        pg.sprite.Sprite.__init__(self)
-        self.image = pg.Surface(BOX_SIZE)
-        self.image.fill(WHITE)
-        self.rect = pg.Rect(position, (self.image.get_width(), self.image.get_height()))
-        self.left_side = (self.rect.bottomleft, self.rect.topleft)
-        self.right_side = (self.rect.bottomright, self.rect.topright)
-        self.top_side = (self.rect.topleft, self.rect.topright)
-        self.bottom_side = (self.rect.bottomleft, self.rect.bottomright)
-    
+class MultiBall(Bodies):
+    """Many balls kept in arrays and moved in one vectorized pass
+
+    The balls follow the rules of Ball.move: they bounce off the walls,
+    the bat and boxes along their path, and take some of the bat's speed.
+    Balls that fall out of the bottom of the screen are dropped.
+    """
+
+    def __init__(self):
+        Bodies.__init__(self, get_ball_image())
+
+    def spawn(self, center, count=MULTIBALL_COUNT, speed=DEFAULT_BALL_SPEED):
+        """Add balls at a position, flying upwards in random directions"""
+        angles = np.radians([random.uniform(-MULTIBALL_SPREAD, MULTIBALL_SPREAD) for _ in range(count)])
+        self.add(np.full(count, center[0] - BALL_SIZE.width / 2), np.full(count, center[1] - BALL_SIZE.height / 2),
+            speed * np.sin(angles), -speed * np.cos(angles))
+
+    def move(self, bat, boxes):
+        """Move all balls, return the boxes that were hit"""
+        self.previous_x, self.previous_y = self.x.copy(), self.y.copy()
+        if len(self) == 0:
+            return []
+
+        # Only boxes near some ball can be hit this frame
+        reach = math.ceil(np.sqrt(self.vx ** 2 + self.vy ** 2).max()) + 1
+        areas = np.unique(np.stack((np.floor(self.x), np.floor(self.y)), axis=1).astype(int), axis=0) - reach
+        size = (BALL_SIZE.width + 2 * reach + 1, BALL_SIZE.height + 2 * reach + 1)
+        candidates = boxes.get_boxes_in(*(pg.Rect(position, size) for position in areas.tolist()))
+
+        targets = [*WALLS, bat.rect, *(box.rect for box in candidates)]
+        target_x, target_y, target_width, target_height = np.array([tuple(rect) for rect in targets], dtype=np.float64).T
+        first_box = len(WALLS) + 1
+
+        hit_boxes = {}
+        def respond(index, target, nx, ny):
+            self.vx[index[target == len(WALLS)]] += bat.speed * BALL_SPEED_FACTOR
+            for target_index in np.unique(target[target >= first_box]).tolist():
+                hit_boxes[candidates[target_index - first_box]] = None
+                # Off the board, like Ball.move no other ball hits it again this frame
+                target_x[target_index] = np.inf
+
+        sweep.bounce_many(self.x, self.y, *BALL_SIZE, self.vx, self.vy,
+            (target_x, target_y, target_width, target_height), respond)
+
+        self.keep(np.round(self.y) < SCREEN_SIZE.height)
+        return list(hit_boxes)
+
+
+class Box(Entity):
+    __slots__ = ("box_type", "hit_points")
+
+    def __init__(self, position, box_type=NORMAL, hit_points=1, size=BOX_SIZE):
+        Entity.__init__(self)
+        self.image = get_box_image(box_type, size)
+        self.rect = self.image.get_rect(topleft=position)
+        self.box_type = box_type
+        self.hit_points = hit_points
+
+    def hit(self):
+        """Take a hit, return True if the box breaks"""
+        if self.box_type == STEEL:
+            return False
+        self.hit_points -= 1
+        return self.hit_points <= 0
+
+
+class BoxGroup(EntityGroup):
+    """Group of boxes with a uniform grid index for collision
+
+    Every box is registered in the grid cells its rect covers. Adding and
+    removing boxes keeps the index up to date, and
+    get_boxes_in() only looks at the boxes in the cells under a rect.
+    """
+
+    def __init__(self, *sprites, cell_size=(BOX_SIZE.width + BOX_PADDING, BOX_SIZE.height + BOX_PADDING)):
+        self.cell_size = Size(*cell_size)
+        self.cells = {}
+        self.counter = itertools.count()
+        EntityGroup.__init__(self, *sprites)
+
+    def get_cells(self, rect):
+        """Return the grid cells covered by a rect"""
+        width, height = self.cell_size
+        return [
+            (i, j)
+            for i in range(rect.left // width, (rect.right - 1) // width + 1)
+            for j in range(rect.top // height, (rect.bottom - 1) // height + 1)
+        ]
+
+    def add_internal(self, sprite):
+        EntityGroup.add_internal(self, sprite)
+        order = next(self.counter)
+        for cell in self.get_cells(sprite.rect):
+            self.cells.setdefault(cell, {})[sprite] = order
+
+    def remove_internal(self, sprite):
+        EntityGroup.remove_internal(self, sprite)
+        for cell in self.get_cells(sprite.rect):
+            boxes = self.cells[cell]
+            del boxes[sprite]
+            if not boxes:
+                del self.cells[cell]
+
+    def get_boxes_in(self, *rects):
+        """Return the boxes overlapping any of the rects in the order they were added"""
+        hits = {}
+        for rect in rects:
+            for cell in self.get_cells(rect):
+                for box, order in self.cells.get(cell, {}).items():
+                    if box not in hits and rect.colliderect(box.rect):
+                        hits[box] = order
+        return sorted(hits, key=hits.get)
+
+
+Stage = namedtuple("Stage", "boxes group breakable")
 
-class Bat(pg.sprite.Sprite):
+
+def make_level(n_row=N_ROW, n_col=N_COL):
+    """Return the records of the built-in level, a grid of boxes from GRID_ANCHOR"""
+    return make_grid_level(GRID_ANCHOR, n_row, n_col, BOX_SIZE, BOX_PADDING)
+
+
+def make_boxes(level):
+    """Return the boxes of the records of a level, in their order"""
+    return [
+        Box(Position(x, y), box_type, hit_points, Size(width, height))
+        for x, y, width, height, box_type, hit_points in level.tolist()
+    ]
+
+
+def prepare_level(level):
+    """Return the Stage of the records of a level, with its boxes in a BoxGroup
+
+    This is the slow part of starting a level, LevelStream runs it in the
+    background while the level before is played.
+    """
+    boxes = make_boxes(level)
+    cell_size = (int(level["width"].max(initial=BOX_SIZE.width)) + BOX_PADDING,
+        int(level["height"].max(initial=BOX_SIZE.height)) + BOX_PADDING)
+    return Stage(boxes, BoxGroup(boxes, cell_size=cell_size), int(np.count_nonzero(level["type"] != STEEL)))
+
+
+class Bat(Entity):
     """Player controlled bat to defend the ball
     
     - The bat moves left and right
@@ -90,8 +271,10 @@ class Bat(pg.sprite.Sprite):
     - The bat has acceleration
     """
     
+    __slots__ = ("speed",)
+
     def __init__(self):
-        pg.sprite.Sprite.__init__(self)
+        Entity.__init__(self)
         self.image = pg.Surface(BAT_SIZE)
         self.image.fill(WHITE)
         self.rect = pg.Rect(DEFAULT_BAT_POSITION, (self.image.get_width(), self.image.get_height()))
@@ -108,95 +291,169 @@ class Bat(pg.sprite.Sprite):
 
 class Menu():
     def __init__(self):
-        self.font = pg.font.SysFont("corbel", TEXT_SIZE, bold=True)
+        self.font = get_font("corbel", TEXT_SIZE, bold=True)
         self.message = "Press SPACE to start the game!"
     
     def get_image(self):
-        return self.font.render(self.message, True, BLACK, WHITE)
+        return render_text(self.message, self.font, BLACK, WHITE)
 
 
-def main():
-    pg.init()
-    screen = pg.display.set_mode(SCREEN_SIZE, pg.SCALED)
-    pg.display.set_caption(GAME_TITLE)
-    pg.mouse.set_visible(False)
+class Game():
+    """Ball, bat and boxes of one game, advanced one frame at a time without a window
 
-    clock = pg.time.Clock()
+    levels is a LevelStream, or the path of a level pack played from
+    start_level on, to play the levels of a pack. Without one the built-in
+    level is played over and over.
+    """
 
-    background = pg.Surface(screen.get_size())
-    background = background.convert()
-    background.fill(BLACK)
-    
-    ball = Ball()
-    bat = Bat()
-    menu = Menu()
-    boxes = [
-        Box(Position(GRID_ANCHOR.x + n * (BOX_SIZE.width + BOX_PADDING), GRID_ANCHOR.y + m * (BOX_SIZE.height + BOX_PADDING)))
-        for n in range(5)
-        for m in range(5)
-    ]
+    def __init__(self, levels=None, start_level=0):
+        self.ball = Ball()
+        self.multiball = MultiBall()
+        self.bat = Bat()
+        if isinstance(levels, str):
+            levels = LevelStream(LevelPack(levels), prepare_level, start_level)
+        self.levels = levels
+        self.start_stage(self.next_stage())
+
+        self.allsprites = EntityGroup(self.ball, self.bat)
+        self.previous = {}
+
+        self.show_menu = True
+        self.frame = 0
+
+    def step(self, left=False, right=False, launch=False, release=False, multiball=False):
+        """Advance the game by one frame
+
+        - left and right tell which arrow keys are held
+        - launch, release and multiball tell if SPACE was pressed, an arrow
+          key was released or M was pressed during the frame
+        """
+        self.previous = snapshot(self.allsprites)
+        if left:
+            self.bat.move(left=True)
+        if right:
+            self.bat.move(right=True)
+
+        if launch:
+            if self.show_menu:
+                self.show_menu = False
+            if self.ball.movement.magnitude() == 0:
+                self.ball.movement.y = DEFAULT_BALL_SPEED
+        if release:
+            self.bat.speed = 0
+        if multiball and not self.show_menu:
+            self.multiball.spawn(self.ball.rect.center)
 
-    allsprites = pg.sprite.Group(ball, bat)
-    allboxes = pg.sprite.Group(boxes)
-
-    show_menu = True
-    menu_image = menu.get_image()
-
-    while True:
-        # Player input here
-        #------------------
-        keys = pg.key.get_pressed()
-        if keys[pg.K_LEFT]:
-            bat.move(left=True)
-        if keys[pg.K_RIGHT]:
-            bat.move(right=True)
-        
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                return
-            elif event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:
-                return
-            elif event.type == pg.KEYDOWN and event.key == pg.K_SPACE:
-                if show_menu:
-                    show_menu = False
-                if ball.movement.magnitude() == 0:
-                    ball.movement.y = DEFAULT_BALL_SPEED
-            elif event.type == pg.KEYUP and (event.key == pg.K_LEFT or event.key == pg.K_RIGHT):
-                bat.speed = 0
-        
-        # Logical updates here
-        #---------------------
-        if ball.is_outside_screen():
-            ball.reset()
-        
-        target_box = pg.sprite.spritecollide(ball, allboxes, dokill=True)
-        if target_box:
-            tgb = target_box[0]
-            ball.collide_box(tgb)
-            del(tgb)
-
-        ball.collide(bat)
-        ball.move()
-
-        if len(allboxes) == 0:
-            show_menu=True
-            ball.reset()
-            allboxes.add(boxes)
-
-        # Render graphics here
-        #---------------------
+        if self.ball.is_outside_screen():
+            self.ball.reset()
+
+        for box in self.ball.move(self.bat, self.allboxes):
+            self.hit_box(box)
+        for box in self.multiball.move(self.bat, self.allboxes):
+            self.hit_box(box)
+
+        if self.breakable == 0:
+            self.show_menu = True
+            self.ball.reset()
+            self.multiball.clear()
+            self.start_stage(self.next_stage())
+
+        self.frame += 1
+
+    def hit_box(self, box):
+        if box.hit():
+            self.allboxes.remove(box)
+            self.breakable -= 1
+
+    def next_stage(self):
+        if self.levels is None:
+            return prepare_level(make_level())
+        return self.levels.next()
+
+    def start_stage(self, stage):
+        self.boxes, self.allboxes, self.breakable = stage
+
+    def get_state(self):
+        """Return the frame, the boxes left and where the balls and the bat are"""
+        return {
+            "frame": self.frame,
+            "boxes": sorted(box.rect.topleft for box in self.allboxes),
+            "ball": list(self.ball.rect.topleft),
+            "multiball": np.round(np.stack((self.multiball.x, self.multiball.y), axis=1)).astype(int).tolist(),
+            "bat": self.bat.rect.x,
+        }
+
+    def draw(self, screen, background, menu_image, alpha=1.0):
+        """Draw the background, the boxes or the menu, and all sprites
+
+        alpha is how far moving things are drawn from their position
+        before the last step to their current one.
+        """
         screen.blit(background, (0, 0))
 
-        if show_menu:
+        if self.show_menu:
             textpos = menu_image.get_rect(centerx=TEXT_POSITION.x, y=TEXT_POSITION.y)
             screen.blit(menu_image, textpos)
         else:
-            allboxes.draw(screen)
+            self.allboxes.draw(screen)
+            self.multiball.draw(screen, alpha)
+
+        blit_all(screen, interpolate(self.allsprites, self.previous, alpha))
+
+    def draw_dirty(self, renderer, menu_image, alpha=1.0):
+        """Redraw the moving balls and the bat and the boxes that broke, or the menu, return the changed areas
+
+        The boxes only move when a stage starts, so they are static sprites.
+        """
+        moving = self.multiball.get_blits(alpha) + interpolate(self.allsprites, self.previous, alpha)
+        if self.show_menu:
+            menu_rect = menu_image.get_rect(centerx=TEXT_POSITION.x, y=TEXT_POSITION.y)
+            return renderer.draw(overlays=[(menu_image, menu_rect)], moving=moving)
+        return renderer.draw(static_sprites=self.allboxes, moving=moving)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description=GAME_TITLE)
+    parser.add_argument("--levels", metavar="FILE", help="play the levels of a level pack, make one with levels.py")
+    parser.add_argument("--start-level", type=int, default=0, help="index of the first level of the pack to play")
+    add_common_arguments(parser)
+    return parser
+
+
+def main(args=None, screen=None, started=None):
+    """Play Boxpong in a window until it is closed or ESCAPE is pressed, return True if it was closed
+
+    The stages are random levels, or with args.levels the levels of a
+    pack from args.start_level on.
+    """
+    args = args if args is not None else make_parser().parse_args([])
+    levels, replay_options = args.levels, None
+    if levels is not None:
+        # Replays build their game from the same pack
+        levels = os.path.abspath(levels)
+        replay_options = {"levels": levels, "start_level": args.start_level}
+    loop = open_game(args, SCREEN_SIZE, GAME_TITLE, BLACK, "boxpong", replay_options, screen, started)
+    screen, background = loop.screen, loop.background
+    pg.mouse.set_visible(False)
+
+    game = Game(levels, args.start_level)
+    menu_image = Menu().get_image()
 
-        allsprites.draw(screen)
-        pg.display.flip()
-        clock.tick(60)
+    def read_inputs(keys):
+        # Key presses wait for the next step if none is due this frame
+        return (keys[pg.K_LEFT], keys[pg.K_RIGHT], loop.pressed(pg.K_SPACE),
+            loop.released(pg.K_LEFT, pg.K_RIGHT), loop.pressed(pg.K_m))
 
+    closed = loop.run(
+        game.step,
+        read_inputs,
+        draw=lambda alpha: game.draw(screen, background, menu_image, alpha),
+        draw_dirty=lambda alpha: game.draw_dirty(loop.renderer, menu_image, alpha),
+        stats=lambda: {"boxes": len(game.allboxes), "balls": 1 + len(game.multiball)},
+    )
+    if game.levels is not None:
+        game.levels.close()
+    return closed
             
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(make_parser().parse_args())
@@ -0,0 +1,139 @@
+"""Recording of the rendered frames of a game, written in a background thread
+
+- The pixels of every frame are copied into one of a ring of buffers
+  allocated up front, a single memory copy per frame
+- A writer thread turns the buffers into files: numbered PNG images, or
+  one raw RGB video file
+- When all buffers wait to be written the frame is dropped, so a slow
+  disk or encoder never slows down the game loop
+- PNG images are compressed with zlib, which lets go of the GIL, the
+  PNG encoder of pg.image.save holds it and stalls the game loop
+"""
+
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+import pygame as pg
+
+CAPTURE_BUFFERS = 8  # Frames that can wait for the writer before frames are dropped
+PNG_COMPRESSION = 1  # zlib level, higher levels make smaller images but the writer keeps up with fewer frames
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def encode_png(rows, width, height):
+    """Return a PNG image of 8 bit RGB rows, each starting with a 0 byte for no filtering"""
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)  # 8 bit RGB, not interlaced
+    return (PNG_SIGNATURE + png_chunk(b"IHDR", header) + png_chunk(b"IDAT", zlib.compress(rows, PNG_COMPRESSION))
+        + png_chunk(b"IEND", b""))
+
+
+class FrameCapture():
+    """Writes the frames of a screen to files while the game runs
+
+    - A path ending in .png gets one image per frame, numbered by the frame
+      they were rendered in, so dropped frames leave gaps: shots/frame.png
+      is written as shots/frame_000000.png, shots/frame_000001.png, ...
+    - A path ending in .rgb gets raw video of the frames that were not
+      dropped, 8 bit RGB, e.g. for ffmpeg -f rawvideo -pix_fmt rgb24
+    - Only 32 bit screens are captured, like every display surface
+    - Without a path no thread is started and capture() and close() return
+      right away
+    """
+
+    def __init__(self, path, screen, buffers=CAPTURE_BUFFERS):
+        self.path = path
+        self.frame = 0
+        self.written = 0
+        self.dropped = 0
+        self.thread = None
+        if path is None:
+            return
+
+        root, ext = os.path.splitext(path)
+        if ext.lower() not in (".png", ".rgb"):
+            raise ValueError(f"can not capture to {path}, use a .png or .rgb file")
+        if screen.get_bitsize() != 32:
+            raise ValueError(f"can not capture a {screen.get_bitsize()} bit screen")
+        self.pattern = f"{root}_{{:06d}}{ext}"
+        self.file = open(path, "wb") if ext.lower() == ".rgb" else None
+
+        # A pixels2d array is indexed (x, y) over rows of pixels, transposed it copies as one block
+        self.width, self.height = screen.get_size()
+        self.buffers = np.empty((buffers, self.height, self.width), dtype=np.uint32)
+        # Byte of every pixel that holds red, green and blue, pixels are little-endian
+        self.channels = [shift // 8 for shift in screen.get_shifts()[:3]]
+        # PNG rows start with a filter byte, 0 for no filtering, raw video rows are just the pixels
+        self.filter_bytes = 1 if self.file is None else 0
+        self.rows = np.zeros((self.height, self.filter_bytes + 3 * self.width), dtype=np.uint8)
+        self.free = queue.SimpleQueue()
+        for i in range(buffers):
+            self.free.put(i)
+        self.filled = queue.SimpleQueue()
+        self.error = None
+        self.thread = threading.Thread(target=self.write_frames, name="capture", daemon=True)
+        self.thread.start()
+
+    def capture(self, screen):
+        """Copy the pixels of the screen to a free buffer, or drop the frame if there is none"""
+        if self.thread is None:
+            return
+        frame = self.frame
+        self.frame += 1
+        try:
+            i = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return
+        pixels = pg.surfarray.pixels2d(screen)
+        np.copyto(self.buffers[i], pixels.T)
+        del pixels  # Unlocks the screen
+        self.filled.put((i, frame))
+
+    def write_frames(self):
+        while True:
+            item = self.filled.get()
+            if item is None:
+                return
+            i, frame = item
+            try:
+                if self.error is None:
+                    self.write(self.buffers[i], frame)
+                    self.written += 1
+            except Exception as error:
+                # Raised again by close(), frames keep being taken so the buffers stay free
+                self.error = error
+            self.free.put(i)
+
+    def write(self, buffer, frame):
+        rgb = self.rows[:, self.filter_bytes:].reshape(self.height, self.width, 3)
+        pixel_bytes = buffer.view(np.uint8).reshape(self.height, self.width, 4)
+        for channel, byte in enumerate(self.channels):
+            rgb[..., channel] = pixel_bytes[..., byte]
+        if self.file is not None:
+            self.file.write(self.rows)
+        else:
+            with open(self.pattern.format(frame), "wb") as f:
+                f.write(encode_png(self.rows, self.width, self.height))
+
+    def close(self):
+        """Write the frames still in the buffers and print how many were written and dropped"""
+        if self.thread is None:
+            return
+        self.filled.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.file is not None:
+            self.file.close()
+        if self.error is not None:
+            raise self.error
+        print(f"{self.written} frames captured to {self.path}, {self.dropped} dropped")
+        if self.file is not None:
+            print(f"play with: ffplay -f rawvideo -pixel_format rgb24 -video_size {self.width}x{self.height} {self.path}")
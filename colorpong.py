@@ -1,11 +1,16 @@
 import pygame as pg
+import numpy as np
 
+import argparse
+import functools
+import heapq
+import math
 import random
-from collections import namedtuple
 
+from engine import Entity, EntityGroup, Position, Size, add_common_arguments, open_game
+from rendercache import RotationAtlas, blit_all, prepare_surface
+from timestep import interpolate, snapshot
 
-Position = namedtuple("Position", "x y")
-Size = namedtuple("Size", "width height")
 
 GAME_TITLE = "Colorpong"
 
@@ -16,6 +21,9 @@ MARGIN = 20
 NOZZLE_SIZE = Size(20, 20)
 NOZZLE_RADIUS = 50
 NOZZLE_RADIAL_SPEED = 3
+NOZZLE_MAX_ROTATION = 80
+# Every whole rotation, after turning to a limit the nozzle is off the multiples of NOZZLE_RADIAL_SPEED
+NOZZLE_ANGLES = range(-NOZZLE_MAX_ROTATION, NOZZLE_MAX_ROTATION + 1)
 NOZZLE_POSITION = Position(MIDDLE.x, SCREEN_SIZE.height - MARGIN)
 
 BACKGROUND_COLOR = pg.Color("black")
@@ -27,17 +35,28 @@ DEFAULT_BALL_SPEED = 10
 BALL_GRID_ROWS = SCREEN_SIZE.height * 0.75 // BALL_SIZE.height
 BALL_GRID_COLS = SCREEN_SIZE.width // BALL_SIZE.width
 
-class Ball(pg.sprite.Sprite):
+
+@functools.lru_cache(maxsize=None)
+def get_ball_image(color_code):
+    """Return the image shared by all balls of a color"""
+    image = pg.Surface(BALL_SIZE)
+    pg.draw.circle(surface=image, color=BALL_COLORS[color_code], center=(BALL_SIZE.width // 2, BALL_SIZE.height // 2), radius=BALL_SIZE.width // 2)
+    return prepare_surface(image, colorkey=BACKGROUND_COLOR)
+
+
+class Ball(Entity):
+    __slots__ = ("color", "color_code", "movement")
+
     def __init__(self, position, color=None):
-        pg.sprite.Sprite.__init__(self)
+        Entity.__init__(self)
 
         if color not in BALL_COLORS:
             self.color = random.choice(BALL_COLORS)
         else:
             self.color = color
-        self.image = pg.Surface(BALL_SIZE)
-        self.rect = pg.draw.circle(surface=self.image, color=self.color, center=(BALL_SIZE.width // 2, BALL_SIZE.height // 2), radius=BALL_SIZE.width // 2)
-        self.rect.center = position
+        self.color_code = BALL_COLORS.index(self.color)
+        self.image = get_ball_image(self.color_code)
+        self.rect = self.image.get_rect(center=position)
 
         self.movement = pg.math.Vector2(0, 0)
     
@@ -55,9 +74,11 @@ class Ball(pg.sprite.Sprite):
         self.rect.move_ip(self.movement.x, self.movement.y)
 
 
-class Nozzle(pg.sprite.Sprite):
+class Nozzle(Entity):
+    __slots__ = ("anchor", "offset", "original", "rotations", "rotation")
+
     def __init__(self):
-        pg.sprite.Sprite.__init__(self)
+        Entity.__init__(self)
 
         self.anchor = pg.math.Vector2(NOZZLE_POSITION)
         self.offset = pg.math.Vector2(0, -NOZZLE_RADIUS)
@@ -66,6 +87,7 @@ class Nozzle(pg.sprite.Sprite):
         pg.draw.polygon(self.image, pg.Color("white"), 
             [(0, NOZZLE_SIZE.height), (NOZZLE_SIZE.width, NOZZLE_SIZE.height), (NOZZLE_SIZE.width // 2, 0)])
         self.original = self.image
+        self.rotations = RotationAtlas(self.original, NOZZLE_ANGLES)
 
         self.rect = self.image.get_rect(center=self.anchor + self.offset)
 
@@ -73,12 +95,12 @@ class Nozzle(pg.sprite.Sprite):
 
     def turn(self, left=False, right=False):
         if left:
-            self.rotation = min(self.rotation + NOZZLE_RADIAL_SPEED, 80)
+            self.rotation = min(self.rotation + NOZZLE_RADIAL_SPEED, NOZZLE_MAX_ROTATION)
         elif right:
-            self.rotation = max(self.rotation - NOZZLE_RADIAL_SPEED, -80)
+            self.rotation = max(self.rotation - NOZZLE_RADIAL_SPEED, -NOZZLE_MAX_ROTATION)
         
         rotated_offset = self.offset.rotate(-self.rotation)
-        self.image = pg.transform.rotate(self.original, self.rotation)
+        self.image = self.rotations.get(self.rotation)
         self.rect = self.image.get_rect(center=self.anchor + rotated_offset)
     
 
@@ -86,13 +108,29 @@ class Nozzle(pg.sprite.Sprite):
         ball.movement = pg.math.Vector2(0, -DEFAULT_BALL_SPEED).rotate(-self.rotation)
 
 
+EMPTY = -1
+
+
 class BallGrid():
-    def __init__(self):
+    """Hexagonal grid of balls hanging from the top of the screen
+
+    - Odd rows are shifted right by half a ball
+    - colors holds the index into BALL_COLORS of every cell, or EMPTY
+    - matrix maps the (row, col) of every occupied cell to its Ball sprite
+    - version goes up on every change, so results worked out from the
+      board can be kept until it changes
+    """
+
+    def __init__(self, n_rows=int(BALL_GRID_ROWS)):
         n_columns = (SCREEN_SIZE.width - 2 * MARGIN) // BALL_SIZE.width
         empty_space_left = ((SCREEN_SIZE.width - 2 * MARGIN) - n_columns * BALL_SIZE.width) / 2
 
+        self.n_rows = n_rows
+        self.n_columns = n_columns
+        self.left = empty_space_left
+
         self.center_points = {}
-        for i in range(int(BALL_GRID_ROWS)):
+        for i in range(n_rows):
             for j in range(n_columns):
                 x = empty_space_left + BALL_SIZE.width / 2 + j * BALL_SIZE.width
                 if i % 2 == 1:
@@ -101,6 +139,9 @@ class BallGrid():
                 self.center_points[(i, j)] = (x, y)
 
         self.matrix = {}
+        self.colors = np.full((n_rows, n_columns), EMPTY, dtype=np.int8)
+        self.version = 0
+        self.group = EntityGroup()
 
         # Add initial pyramid pattern
         pyramid_width = 10
@@ -109,17 +150,21 @@ class BallGrid():
                 color = random.choice(BALL_COLORS)
                 col =  n + (n_columns - pyramid_width)//2
                 pos = self.center_points[(m,col)]
-                self.matrix[(m, col)] = Ball(pos, color)
-        
-        self.group = pg.sprite.Group(self.matrix.values())
-    
-    @property
-    def rects(self):
-        return {
-            key: value.rect
-            for key, value in self.matrix.items()
-        }
-    
+                self.place(m, col, Ball(pos, color))
+
+    def place(self, row, col, ball):
+        """Put a ball into a cell"""
+        self.matrix[(row, col)] = ball
+        self.colors[row, col] = ball.color_code
+        self.group.add(ball)
+        self.version += 1
+
+    def remove(self, row, col):
+        """Take the ball out of a cell"""
+        ball = self.matrix.pop((row, col))
+        self.colors[row, col] = EMPTY
+        self.group.remove(ball)
+        self.version += 1
 
     def add_ball_hit(self, ball, row, col):
         ball.rect.center = self.center_points[(row, col)]
@@ -129,54 +174,100 @@ class BallGrid():
 
         if len(matches) >= 2:
             for key, b in matches:
-                del self.matrix[key]
-                self.group.remove(b)
+                self.remove(*key)
+            # Only balls next to the removed cluster can have lost their hold
+            self.delete_hanging_balls(n for key, b in matches for n in self.get_neighbors(*key))
         else:
-            self.matrix[(row, col)] = ball
-            self.group.add(ball)
-        
-        self.delete_hanging_balls()
-    
-    def get_adjacent_matches(self, row, col, color, seen):
+            self.place(row, col, ball)
+            self.drop_if_loose(row, col)
+
+    def get_neighbors(self, row, col):
+        """Return the cells around a cell that lie inside the grid"""
         if row % 2 == 0:
             neighbors = [(row+1, col-1), (row+1, col), (row, col-1), (row, col+1), (row-1, col-1), (row-1, col)]
         else:
             neighbors = [(row+1, col), (row+1, col+1), (row, col-1), (row, col+1), (row-1, col), (row-1, col+1)]
+        return [(r, c) for r, c in neighbors if 0 <= r < self.n_rows and 0 <= c < self.n_columns]
+
+    def get_adjacent_matches(self, row, col, color, seen):
+        """Return (key, ball) of every ball connected to a cell through balls of the color
 
+        A color of None matches any ball. Cells in seen are skipped and
+        every returned cell is added to it.
+        """
+        code = None if color is None else BALL_COLORS.index(color)
         matches = []
-        for key in neighbors:
-            if key not in self.matrix:
-                continue
-            ball = self.matrix[key]
-            if (ball.color == color or color is None) and key not in seen:
-                # add match to result and recursive call
-                matches.append((key, ball))
+        stack = [(row, col)]
+        while stack:
+            for key in self.get_neighbors(*stack.pop()):
+                ball = self.matrix.get(key)
+                if ball is None or key in seen or (code is not None and ball.color_code != code):
+                    continue
                 seen.add(key)
-                matches.extend(self.get_adjacent_matches(key[0], key[1], color, seen))
-
+                matches.append((key, ball))
+                stack.append(key)
         return matches
-    
+
     def add_ball_miss(self, ball):
         x, y = ball.rect.center
         row, col = self.get_nearest_free_space(x, y)
-        self.matrix[(row, col)] = ball
-        self.group.add(ball)
+        self.place(row, col, ball)
         ball.rect.center = self.center_points[(row, col)]
         ball.movement = pg.math.Vector2(0, 0)
+        self.drop_if_loose(row, col)
 
     def get_nearest_free_space(self, x, y):
+        """Return the free cell whose center is closest to (x, y), or None if the grid is full
+
+        The search starts at the cell under the point and grows ring by ring
+        until no cell further out can be closer than the best one found.
+        """
+        w, h = BALL_SIZE
+        row = min(max(round((y - MARGIN - h / 2) / h), 0), self.n_rows - 1)
+        col = min(max(round((x - self.left - w / 2) / w), 0), self.n_columns - 1)
+
         nearest = None
-        min_distance = 1E6
-        for key, value in self.center_points.items():
-            if key not in self.matrix:
-                distance = pg.math.Vector2(x, y).distance_to(pg.math.Vector2(value))
-                if distance < min_distance:
-                    nearest = key
-                    min_distance = distance
+        for radius in range(max(self.n_rows, self.n_columns)):
+            row_min, row_max = max(row - radius, 0), min(row + radius, self.n_rows - 1)
+            col_min, col_max = max(col - radius, 0), min(col + radius, self.n_columns - 1)
+            # Visit the window in row-major order, so ties resolve like a scan of the full board
+            nearest = None
+            min_distance = 1E6
+            for i in range(row_min, row_max + 1):
+                for j in range(col_min, col_max + 1):
+                    if self.colors[i, j] == EMPTY:
+                        cx, cy = self.center_points[(i, j)]
+                        distance = math.hypot(x - cx, y - cy)
+                        if distance < min_distance:
+                            nearest = (i, j)
+                            min_distance = distance
+            # Cells outside the window are at least this far away
+            if min_distance < min(radius * w, (radius + 0.5) * h):
+                break
         return nearest
 
+    def get_candidate_cells(self, rect):
+        """Return the occupied cells whose ball could overlap the rect
+
+        Only the few cells under the rect are looked at, so the cost does
+        not depend on the size of the board.
+        """
+        w, h = BALL_SIZE
+        row_min = max(int((rect.top - MARGIN) // h) - 1, 0)
+        row_max = min(int((rect.bottom - MARGIN) // h), self.n_rows - 1)
+        col_min = max(int((rect.left - self.left) // w) - 1, 0)
+        col_max = min(int((rect.right - self.left) // w), self.n_columns - 1)
+        if row_min > row_max or col_min > col_max:
+            return []
+
+        window = self.colors[row_min:row_max + 1, col_min:col_max + 1]
+        return [(row_min + r, col_min + c) for r, c in zip(*np.nonzero(window != EMPTY))]
+
     def collide(self, ball):
-        collision_params = ball.rect.collidedict(self.rects, True)
+        collision_params = any(
+            ball.rect.colliderect(self.matrix[key].rect)
+            for key in self.get_candidate_cells(ball.rect)
+        )
         if collision_params:
             x, y = ball.rect.center
             row, col = self.get_nearest_free_space(x, y)
@@ -184,77 +275,168 @@ class BallGrid():
             return True
         return False
 
-    def delete_hanging_balls(self):
-        starting_points = filter(lambda t: t[0] == 0, self.matrix)
+    def drop_if_loose(self, row, col):
+        """Remove a newly placed ball unless it holds on to the top row
+
+        All other balls already hang from the top row, so touching any of
+        them is enough and no search is needed.
+        """
+        if row != 0 and not any(key in self.matrix for key in self.get_neighbors(row, col)):
+            self.remove(row, col)
+
+    def delete_hanging_balls(self, around=None):
+        """Remove every ball that is not connected to the top row
+
+        - around limits the check to the balls connected to these cells,
+          the ones that can have lost their hold after the last change
+        - Searches walk upwards first and stop as soon as they reach the top row,
+          so an attached ball costs about as many steps as its row number
+        """
+        if around is None:
+            around = list(self.matrix)
+
+        attached = set()
+        for start in around:
+            if start not in self.matrix or start in attached:
+                continue
+            seen = {start}
+            queue = [start]
+            while queue:
+                key = heapq.heappop(queue)
+                if key[0] == 0 or key in attached:
+                    attached.update(seen)
+                    break
+                for neighbor in self.get_neighbors(*key):
+                    if neighbor in self.matrix and neighbor not in seen:
+                        seen.add(neighbor)
+                        heapq.heappush(queue, neighbor)
+            else:
+                for key in seen:
+                    self.remove(*key)
+
+
+class Game():
+    """Nozzle, flying balls and ball grid of one game, advanced one frame at a time without a window"""
 
-        not_hanging = set()
-        for row, col in starting_points:
-            not_hanging.add((row, col))
-            for elem in map(lambda t: t[0], self.get_adjacent_matches(row, col, None, {(row, col)})):
-                    not_hanging.add(elem)
-            
-        
-        items = list(self.matrix.items())
-        for key, ball in items:
-            if key not in not_hanging:
-                del self.matrix[key]
-                self.group.remove(ball)
-            
-def main():
-    pg.init()
-    screen = pg.display.set_mode(SCREEN_SIZE, pg.SCALED)
-    clock = pg.time.Clock()
-
-    background = pg.Surface(screen.get_size())
-    background.fill(BACKGROUND_COLOR)
-
-    balls = pg.sprite.Group([])
-    active_ball = Ball(NOZZLE_POSITION, random.choice(BALL_COLORS))
-    nozzle = Nozzle()
-    playersprites = pg.sprite.Group(nozzle, active_ball)
-
-    ball_grid = BallGrid()
-
-    while True:
-        keys = pg.key.get_pressed()
-        if keys[pg.K_LEFT]:
-            nozzle.turn(left=True)
-        elif keys[pg.K_RIGHT]:
-            nozzle.turn(right=True)
-
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                return
-            elif event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:
-                return
-            elif event.type == pg.KEYDOWN and event.key == pg.K_SPACE:
-                nozzle.shoot(active_ball)
-                playersprites.remove(active_ball)
-                balls.add(active_ball)
-                active_ball = Ball(NOZZLE_POSITION, random.choice(BALL_COLORS))
-                playersprites.add(active_ball)
-    
-        # Logical updates here
-        #---------------------
-        for ball in balls:
+    def __init__(self):
+        self.balls = EntityGroup()
+        self.active_ball = Ball(NOZZLE_POSITION, random.choice(BALL_COLORS))
+        self.nozzle = Nozzle()
+        self.playersprites = EntityGroup(self.nozzle, self.active_ball)
+
+        self.ball_grid = BallGrid()
+        self.previous = {}
+        self.frame = 0
+
+    def step(self, left=False, right=False, shoot=False):
+        """Advance the game by one frame
+
+        left and right tell which arrow keys are held, shoot tells if
+        SPACE was pressed during the frame.
+        """
+        self.previous = snapshot(self.get_moving_sprites())
+        if left:
+            self.nozzle.turn(left=True)
+        elif right:
+            self.nozzle.turn(right=True)
+
+        if shoot:
+            self.nozzle.shoot(self.active_ball)
+            self.playersprites.remove(self.active_ball)
+            self.balls.add(self.active_ball)
+            self.active_ball = Ball(NOZZLE_POSITION, random.choice(BALL_COLORS))
+            self.playersprites.add(self.active_ball)
+
+        for ball in self.balls:
             ball.move()
-            collision_occured = ball_grid.collide(ball)
+            collision_occured = self.ball_grid.collide(ball)
             if collision_occured:
-                balls.remove(ball)
+                self.balls.remove(ball)
             elif ball.rect.top <= MARGIN:
-                ball_grid.add_ball_miss(ball)
-                balls.remove(ball)
-            
+                self.ball_grid.add_ball_miss(ball)
+                self.balls.remove(ball)
+
+        self.frame += 1
 
-        # Render graphics here
-        #---------------------
+    def get_moving_sprites(self):
+        return (*self.balls, *self.playersprites)
+
+    def get_state(self):
+        """Return the frame, the colors of the grid, the flying balls and the aim and color of the next shot"""
+        return {
+            "frame": self.frame,
+            "grid": self.ball_grid.colors.tolist(),
+            "balls": [list(ball.rect.topleft) for ball in self.balls],
+            "rotation": self.nozzle.rotation,
+            "next_color": self.active_ball.color_code,
+        }
+
+    def draw(self, screen, background, alpha=1.0):
+        """Draw the background, the flying balls, the nozzle and the grid
+
+        alpha is how far the flying balls are drawn from their position
+        before the last step to their current one.
+        """
         screen.blit(background, (0, 0))
-        balls.draw(screen)
-        playersprites.draw(screen)
-        ball_grid.group.draw(screen)
-        clock.tick(60)
-        pg.display.flip()
+        blit_all(screen, interpolate(self.get_moving_sprites(), self.previous, alpha))
+        self.ball_grid.group.draw(screen)
+
+    def draw_dirty(self, renderer, alpha=1.0):
+        """Redraw the flying balls, the nozzle and the grid cells that changed, return the changed areas"""
+        moving = interpolate(self.get_moving_sprites(), self.previous, alpha)
+        return renderer.draw(static_sprites=self.ball_grid.group, moving=moving)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description=GAME_TITLE)
+    parser.add_argument("--cpu", action="store_true", help="let the computer aim and shoot")
+    parser.add_argument("--aim-assist", action="store_true", help="show where a shot lands and the best shot, A toggles it")
+    add_common_arguments(parser)
+    return parser
+
+
+def main(args=None, screen=None, started=None):
+    """Play Colorpong in a window until it is closed or ESCAPE is pressed, return True if it was closed
+
+    With args.cpu the computer aims and shoots, A toggles the aim assist.
+    """
+    # shotplanner imports this module
+    from shotplanner import CPUPlayer, ShotPlanner
+
+    args = args if args is not None else make_parser().parse_args([])
+    loop = open_game(args, SCREEN_SIZE, GAME_TITLE, BACKGROUND_COLOR, "colorpong", screen=screen, started=started)
+    screen, background = loop.screen, loop.background
+
+    game = Game()
+    planner = ShotPlanner(game.ball_grid)
+    cpu_player = CPUPlayer(planner) if args.cpu else None
+    aim_assist = args.aim_assist
+
+    def read_inputs(keys):
+        if cpu_player is not None:
+            return cpu_player(game)
+        # A shot waits for the next step if none is due this frame
+        return keys[pg.K_LEFT], keys[pg.K_RIGHT], loop.pressed(pg.K_SPACE)
+
+    def on_event(event):
+        nonlocal aim_assist
+        if event.type == pg.KEYDOWN and event.key == pg.K_a:
+            aim_assist = not aim_assist
+
+    def draw(alpha):
+        game.draw(screen, background, alpha)
+        if aim_assist:
+            planner.draw(screen, game.active_ball.color_code, game.nozzle.rotation)
+
+    def draw_dirty(alpha):
+        # The aim assist overlay is drawn over everything, so it needs full redraws
+        if aim_assist:
+            return None
+        return game.draw_dirty(loop.renderer, alpha)
+
+    return loop.run(game.step, read_inputs, draw, draw_dirty, on_event,
+        stats=lambda: {"grid": len(game.ball_grid.matrix), "flying": len(game.balls)})
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(make_parser().parse_args())
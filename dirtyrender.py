@@ -0,0 +1,76 @@
+import pygame as pg
+
+from rendercache import blit_all
+
+
+class DirtyRenderer():
+    """Redraws only the parts of the screen that changed since the last frame
+
+    Every frame is described by three layers, drawn bottom to top:
+
+    - static sprites, such as boxes or grid balls, are only repainted when
+      they appear, disappear or something moved over them. They are not
+      even compared while their group's version is unchanged, and groups
+      with a get_boxes_in(rect) index like BoxGroup are only searched
+      under the changed areas
+    - overlays are (surface, rect) pairs like a score text, repainted when
+      they change or something moved over them
+    - moving things are (image, rect) pairs, like balls and bats, cleared
+      and redrawn every frame
+
+    draw() returns the changed areas for pg.display.update.
+    """
+
+    def __init__(self, screen, background):
+        self.screen = screen
+        self.background = background
+        self.invalidate()
+
+    def invalidate(self):
+        """Make the next frame a full redraw, e.g. after something else drew on the screen"""
+        self.full_redraw = True
+        self.static = {}
+        self.static_version = None
+        self.overlays = []
+        self.moving_rects = []
+
+    def draw(self, static_sprites=(), overlays=(), moving=()):
+        version = getattr(static_sprites, "version", None)
+        if version is not None and (static_sprites, version) == self.static_version:
+            static = self.static
+        else:
+            static = {sprite: sprite.rect.copy() for sprite in static_sprites}
+        self.static_version = (static_sprites, version)
+        overlays = [(surface, pg.Rect(rect)) for surface, rect in overlays]
+
+        if self.full_redraw:
+            self.full_redraw = False
+            self.screen.blit(self.background, (0, 0))
+            blit_all(self.screen, [(sprite.image, rect) for sprite, rect in static.items()])
+            blit_all(self.screen, overlays)
+            dirty = [self.screen.get_rect()]
+        else:
+            # Areas left by moving things, and by static sprites or overlays that changed
+            dirty = self.moving_rects
+            if static is not self.static:
+                dirty.extend(rect for sprite, rect in self.static.items() if static.get(sprite) != rect)
+                dirty.extend(rect for sprite, rect in static.items() if self.static.get(sprite) != rect)
+            if overlays != self.overlays:
+                dirty.extend(rect for surface, rect in self.overlays)
+                dirty.extend(rect for surface, rect in overlays)
+
+            blit_all(self.screen, [(self.background, rect, rect) for rect in dirty])
+            get_boxes_in = getattr(static_sprites, "get_boxes_in", None)
+            if static is self.static and get_boxes_in is not None:
+                under = dict.fromkeys(sprite for rect in dirty for sprite in get_boxes_in(rect))
+                blit_all(self.screen, [(sprite.image, static[sprite]) for sprite in under])
+            else:
+                blit_all(self.screen, [(sprite.image, rect) for sprite, rect in static.items() if rect.collidelist(dirty) != -1])
+            blit_all(self.screen, [(surface, rect) for surface, rect in overlays if rect.collidelist(dirty) != -1])
+
+        self.moving_rects = self.screen.blits(moving)
+        dirty.extend(self.moving_rects)
+
+        self.static = static
+        self.overlays = overlays
+        return dirty
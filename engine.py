@@ -0,0 +1,313 @@
+"""Parts shared by the games: entities, their groups and storage, and the game loop
+
+- Entity and EntityGroup stand in for pg.sprite.Sprite and Group. An
+  entity only has slots, no __dict__ and no reference to its groups,
+  only groups know their entities, so boards of many thousands of boxes
+  or balls take a fraction of the memory
+- Bodies keeps many moving things in NumPy arrays, one array per
+  component, and moves or draws all of them in one call
+- GameLoop runs the input, logic and render loop of a game, in a window
+  made with open_window or one that another game or a launcher made
+- add_common_arguments and open_game give every game the same command
+  line options for profiling, recording and capturing and the same setup
+"""
+
+import time
+from collections import namedtuple
+
+import numpy as np
+import pygame as pg
+
+from capture import FrameCapture
+from dirtyrender import DirtyRenderer
+from profiler import FrameProfiler
+from rendercache import blit_all
+from replay import ReplayWriter
+from timestep import LOGIC_RATE, FixedTimestep
+
+Position = namedtuple("Position", "x y")
+Size = namedtuple("Size", "width height")
+
+
+def open_window(size, title, screen=None):
+    """Return a window of a size with a title, reusing screen if it has that size
+
+    Only the display and font modules are initialized, pg.init() would
+    also start audio and joysticks, which no game uses.
+    """
+    pg.display.init()
+    pg.font.init()
+    if screen is None or screen.get_size() != tuple(size):
+        screen = pg.display.set_mode(size, pg.SCALED)
+    pg.display.set_caption(title)
+    return screen
+
+
+def add_common_arguments(parser):
+    """Add the command line options every game has, open_game() takes the parsed arguments"""
+    parser.add_argument("--profile", action="store_true", help="record frame timings, F3 shows them on screen")
+    parser.add_argument("--profile-log", metavar="FILE", help="write frame timings to a .csv or .jsonl file")
+    parser.add_argument("--dirty-rects", action="store_true", help="only redraw the parts of the screen that changed")
+    parser.add_argument("--fps", type=int, default=60,
+        help=f"most frames rendered per second, 0 for no limit, the game logic always runs at {LOGIC_RATE} steps per second")
+    parser.add_argument("--record", metavar="FILE", help="write the inputs to a replay file, play it back with replay.py")
+    parser.add_argument("--seed", type=int, help="seed of the random numbers, recordings without one get a random seed")
+    parser.add_argument("--capture", metavar="FILE", help="write the frames to numbered .png images or a raw .rgb video")
+
+
+def open_game(args, size, title, background_color, game, replay_options=None, screen=None, started=None):
+    """Open the window of a game and return a GameLoop for it, set up by the common options in args
+
+    - game is the name replay.py knows the game by, replay_options are the
+      keyword arguments its class is made with on playback
+    - The random module is seeded here, so make the game afterwards
+    - screen and started are passed on to open_window and GameLoop
+    """
+    screen = open_window(size, title, screen)
+    background = pg.Surface(screen.get_size()).convert()
+    background.fill(background_color)
+    recorder = ReplayWriter(args.record, game, args.seed, replay_options)
+    profiler = FrameProfiler(args.profile or args.profile_log is not None, args.profile_log)
+    return GameLoop(screen, background, args.fps, args.dirty_rects, profiler, recorder, started, FrameCapture(args.capture, screen))
+
+
+class Entity():
+    """Something drawn with an image at a rect
+
+    Subclasses list their own attributes in __slots__, so entities keep
+    having no __dict__. An entity does not know its groups, so there is
+    no alive() or kill(), ask or remove it from the groups instead.
+    """
+
+    __slots__ = ("image", "rect")
+
+
+class EntityGroup():
+    """Ordered set of entities, drawn with a single blit_all call
+
+    - Iterating goes over a copy, so entities can be added and removed
+      while iterating
+    - version goes up on every change, so a renderer can tell that
+      nothing was added or removed since the last frame
+    """
+
+    def __init__(self, *entities):
+        self.entities = {}
+        self.version = 0
+        self.add(*entities)
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __iter__(self):
+        return iter(list(self.entities))
+
+    def __contains__(self, entity):
+        return entity in self.entities
+
+    def add(self, *entities):
+        """Add entities, or iterables of entities, that are not in the group yet"""
+        for entity in entities:
+            if not isinstance(entity, Entity):
+                self.add(*entity)
+            elif entity not in self.entities:
+                self.add_internal(entity)
+
+    def remove(self, *entities):
+        """Remove entities, or iterables of entities, that are in the group"""
+        for entity in entities:
+            if not isinstance(entity, Entity):
+                self.remove(*entity)
+            elif entity in self.entities:
+                self.remove_internal(entity)
+
+    def add_internal(self, entity):
+        self.entities[entity] = None
+        self.version += 1
+
+    def remove_internal(self, entity):
+        del self.entities[entity]
+        self.version += 1
+
+    def empty(self):
+        self.remove(*self.entities)
+
+    def draw(self, surface):
+        blit_all(surface, [(entity.image, entity.rect) for entity in self.entities])
+
+
+class Bodies():
+    """Many moving things of the same image, with one NumPy array per component
+
+    x and y are the top-left corners, vx and vy the movement per step and
+    previous_x and previous_y the corners before the last move, to draw
+    them in between.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self.clear()
+
+    def __len__(self):
+        return len(self.x)
+
+    def clear(self):
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.vx = np.zeros(0)
+        self.vy = np.zeros(0)
+        self.previous_x = np.zeros(0)
+        self.previous_y = np.zeros(0)
+
+    def add(self, x, y, vx, vy):
+        """Add bodies, from arrays of equal length"""
+        self.x = np.concatenate((self.x, x))
+        self.y = np.concatenate((self.y, y))
+        self.vx = np.concatenate((self.vx, vx))
+        self.vy = np.concatenate((self.vy, vy))
+        self.previous_x = np.concatenate((self.previous_x, x))
+        self.previous_y = np.concatenate((self.previous_y, y))
+
+    def keep(self, mask):
+        """Drop the bodies where a boolean array is False"""
+        if not mask.all():
+            self.x, self.y, self.vx, self.vy = self.x[mask], self.y[mask], self.vx[mask], self.vy[mask]
+            self.previous_x, self.previous_y = self.previous_x[mask], self.previous_y[mask]
+
+    def move(self):
+        """Move every body by its movement, subclasses add what they bounce off"""
+        self.previous_x, self.previous_y = self.x.copy(), self.y.copy()
+        self.x += self.vx
+        self.y += self.vy
+
+    def get_blits(self, alpha=1.0):
+        """Return the (image, position) of every body, alpha of the way from before the last move to now"""
+        x = self.previous_x + (self.x - self.previous_x) * alpha
+        y = self.previous_y + (self.y - self.previous_y) * alpha
+        positions = np.stack((np.round(x), np.round(y)), axis=1).astype(int).tolist()
+        return [(self.image, position) for position in positions]
+
+    def draw(self, surface, alpha=1.0):
+        blit_all(surface, self.get_blits(alpha))
+
+
+class GameLoop():
+    """The input, logic and render loop of a game in a window
+
+    - QUIT and ESCAPE end the loop, F3 shows the profiler overlay
+    - Key presses and releases are kept until a logic step takes them with
+      pressed() or released(), so they are not lost in frames without a step
+    - Logic steps run at LOGIC_RATE, frames are rendered up to fps times per
+      second with the moving things drawn between the last two steps
+    - With a started time from time.perf_counter(), the time until the
+      first frame is shown is printed
+    - A capture, a FrameCapture, gets every frame once it is shown
+    """
+
+    def __init__(self, screen, background, fps=60, dirty_rects=False, profiler=None, recorder=None, started=None, capture=None):
+        self.screen = screen
+        self.background = background
+        self.started = started
+        self.fps = fps
+        self.dirty_rects = dirty_rects
+        self.profiler = profiler if profiler is not None else FrameProfiler(False)
+        self.recorder = recorder
+        self.capture = capture
+        self.renderer = DirtyRenderer(screen, background)
+        self.timestep = FixedTimestep()
+        self.clock = pg.time.Clock()
+        self.pending = set()  # (event type, key) of key presses and releases no step has taken yet
+
+    def pressed(self, *keys):
+        """Return True if one of the keys was pressed since a step last took it"""
+        return self.take(pg.KEYDOWN, keys)
+
+    def released(self, *keys):
+        """Return True if one of the keys was released since a step last took it"""
+        return self.take(pg.KEYUP, keys)
+
+    def take(self, event_type, keys):
+        taken = [(event_type, key) for key in keys if (event_type, key) in self.pending]
+        self.pending.difference_update(taken)
+        return bool(taken)
+
+    def close(self):
+        self.profiler.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.capture is not None:
+            self.capture.close()
+
+    def run(self, step, read_inputs, draw, draw_dirty=None, on_event=None, stats=None):
+        """Run the game until the window is closed or ESCAPE is pressed, return True if the window was closed
+
+        - read_inputs(keys) returns the arguments of step() for one logic
+          step, keys are the held keys as returned by pg.key.get_pressed()
+        - draw(alpha) draws a whole frame, draw_dirty(alpha) draws with
+          self.renderer and returns the changed areas, or None when the
+          frame needs a full redraw
+        - on_event(event) is called with every event, stats() returns the
+          counts the profiler records with every frame
+        - The profiler, the recorder and the capture are called every frame,
+          whether they are enabled or not, and closed when the loop ends,
+          also by an exception
+        """
+        profiler = self.profiler
+        try:
+            while True:
+                profiler.start_frame()
+
+                # Player input here
+                #------------------
+                keys = pg.key.get_pressed()
+
+                for event in pg.event.get():
+                    if event.type == pg.QUIT:
+                        return True
+                    elif event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:
+                        return False
+                    elif event.type == pg.KEYDOWN and event.key == pg.K_F3:
+                        profiler.toggle()
+                    elif event.type == pg.KEYDOWN or event.type == pg.KEYUP:
+                        self.pending.add((event.type, event.key))
+                    if on_event is not None:
+                        on_event(event)
+                profiler.mark("events")
+
+                # Logical updates here
+                #---------------------
+                steps = self.timestep.advance()
+                for _ in range(steps):
+                    inputs = read_inputs(keys)
+                    if self.recorder is not None:
+                        self.recorder.record(*inputs)
+                    step(*inputs)
+                profiler.mark("logic")
+
+                # Render graphics here
+                #---------------------
+                rects = None
+                if self.dirty_rects and draw_dirty is not None and not profiler.visible:
+                    rects = draw_dirty(self.timestep.alpha)
+                if rects is not None:
+                    profiler.mark("blit")
+                    pg.display.update(rects)
+                else:
+                    draw(self.timestep.alpha)
+                    profiler.draw(self.screen)
+                    self.renderer.invalidate()
+                    profiler.mark("blit")
+                    pg.display.flip()
+                profiler.mark("flip")
+                if self.capture is not None:
+                    self.capture.capture(self.screen)
+                    profiler.mark("capture")
+                if self.started is not None:
+                    print(f"first frame shown {(time.perf_counter() - self.started) * 1000:.0f} ms after start", flush=True)
+                    self.started = None
+                self.clock.tick(self.fps)
+                profiler.mark("wait")
+                profiler.end_frame(steps=steps, **(stats() if stats is not None else {}))
+        finally:
+            # Also when a step or draw raises, so replays, logs and captures keep their last frames
+            self.close()
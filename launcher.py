@@ -0,0 +1,127 @@
+"""One window to pick and play the games in, quick to start
+
+- Only the display and font modules of pygame are initialized, and a
+  game is imported only once it is picked, so the menu shows before
+  NumPy and the games are loaded
+- The system fonts the games use are looked up in a background thread
+  while the menu waits for a key
+- Games play in the window of the menu, ESCAPE goes back to the menu
+- The time from start to the first frame of the menu and of every game
+  is printed
+"""
+
+import time
+
+START = time.perf_counter()
+
+import argparse
+import importlib
+import threading
+
+import pygame as pg
+
+TITLE = "Pong games"
+SCREEN_SIZE = (1200, 900)  # Same as the games, so their window is reused
+BACKGROUND_COLOR = pg.Color("black")
+TEXT_COLOR = pg.Color("white")
+SELECTED_COLOR = pg.Color("gold")
+HELP_COLOR = pg.Color("gray60")
+TITLE_SIZE = 80
+TEXT_SIZE = 48
+HELP_SIZE = 28
+LINE_HEIGHT = 90
+
+# (module, title, help) of every game, in menu order
+GAMES = (
+    ("pong", "Pong", "W S and UP DOWN move the bats"),
+    ("boxpong", "Boxpong", "LEFT RIGHT move the bat, SPACE launches"),
+    ("colorpong", "Colorpong", "LEFT RIGHT turn the nozzle, SPACE shoots, A aims"),
+)
+
+
+def warm_fonts():
+    """Look up the system fonts in a background thread, the first SysFont call of a game does it otherwise"""
+    threading.Thread(target=pg.font.get_fonts, name="fonts", daemon=True).start()
+
+
+def draw_menu(screen, fonts, selected):
+    title_font, text_font, help_font = fonts
+    screen.fill(BACKGROUND_COLOR)
+    width = screen.get_width()
+    title = title_font.render(TITLE, True, TEXT_COLOR)
+    screen.blit(title, title.get_rect(midtop=(width // 2, 120)))
+    for i, (_, name, help_text) in enumerate(GAMES):
+        y = 300 + i * LINE_HEIGHT * 2
+        color = SELECTED_COLOR if i == selected else TEXT_COLOR
+        text = text_font.render(f"{i + 1}  {name}", True, color)
+        screen.blit(text, text.get_rect(midtop=(width // 2, y)))
+        text = help_font.render(help_text, True, HELP_COLOR)
+        screen.blit(text, text.get_rect(midtop=(width // 2, y + LINE_HEIGHT // 2 + 10)))
+    text = help_font.render("1-3 or UP DOWN and ENTER to play, ESCAPE to quit", True, HELP_COLOR)
+    screen.blit(text, text.get_rect(midbottom=(width // 2, screen.get_height() - 40)))
+    pg.display.flip()
+
+
+def choose(screen, selected=0, started=None):
+    """Show the menu until a game is picked, return its index, or None to quit
+
+    The menu is only redrawn after an event, it waits for them without
+    using the CPU.
+    """
+    # pg.font.Font(None) is the font that comes with pygame, no system font lookup
+    fonts = (pg.font.Font(None, TITLE_SIZE), pg.font.Font(None, TEXT_SIZE), pg.font.Font(None, HELP_SIZE))
+    pg.display.set_caption(TITLE)
+    pg.mouse.set_visible(True)
+    draw_menu(screen, fonts, selected)
+    if started is not None:
+        print(f"menu shown {(time.perf_counter() - started) * 1000:.0f} ms after start", flush=True)
+    while True:
+        event = pg.event.wait()
+        if event.type == pg.QUIT:
+            return None
+        elif event.type == pg.KEYDOWN:
+            if event.key == pg.K_ESCAPE:
+                return None
+            elif event.key in (pg.K_RETURN, pg.K_KP_ENTER, pg.K_SPACE):
+                return selected
+            elif pg.K_1 <= event.key < pg.K_1 + len(GAMES):
+                return event.key - pg.K_1
+            elif event.key == pg.K_UP:
+                selected = (selected - 1) % len(GAMES)
+            elif event.key == pg.K_DOWN:
+                selected = (selected + 1) % len(GAMES)
+        draw_menu(screen, fonts, selected)
+
+
+def play(screen, index, started):
+    """Import a game and play it in the window, return True if the window was closed"""
+    game = importlib.import_module(GAMES[index][0])
+    return game.main(screen=screen, started=started)
+
+
+def main(game=None):
+    pg.display.init()
+    pg.font.init()
+    screen = pg.display.set_mode(SCREEN_SIZE, pg.SCALED)
+    warm_fonts()
+
+    names = [module for module, _, _ in GAMES]
+    selected = names.index(game) if game is not None else 0
+    closed = game is not None and play(screen, selected, START)
+    started = START if game is None else None
+    while not closed:
+        selected = choose(screen, selected, started)
+        started = None
+        if selected is None:
+            break
+        closed = play(screen, selected, time.perf_counter())
+        pg.event.clear()
+    pg.quit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=TITLE)
+    parser.add_argument("--game", choices=[module for module, _, _ in GAMES], help="start this game without showing the menu first")
+    args = parser.parse_args()
+
+    main(args.game)
@@ -0,0 +1,211 @@
+"""Level packs for boxpong: many levels of boxes in one memory-mapped file
+
+A level is a NumPy array of BOX records, one per box. A pack file
+holds a header, the records of every level one after the other and an
+index of where each level starts:
+
+- Opening a pack only maps the file and reads the index, the records of
+  a level are read from disk when the level is used
+- Packs are written one level at a time, so generated packs can be
+  larger than memory
+- LevelStream plays the levels of a pack in order and prepares the next
+  level in a background thread while the current one is played
+"""
+
+import argparse
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+MAGIC = b"PGLV"
+VERSION = 1
+HEADER = struct.Struct("<4sBIQ")  # magic, version, number of levels, offset of the index
+
+BOX = np.dtype([
+    ("x", "<i2"),
+    ("y", "<i2"),
+    ("width", "<u2"),
+    ("height", "<u2"),
+    ("type", "u1"),
+    ("hit_points", "u1"),
+])
+INDEX = np.dtype([("offset", "<u8"), ("count", "<u8")])
+
+# Box types
+NORMAL = 0
+HARD = 1  # Takes hit_points hits
+STEEL = 2  # Can not be broken, levels are cleared without it
+
+MAX_HIT_POINTS = 3
+BOX_WEIGHTS = (0.8, 0.15, 0.05)  # Chance of every box type in generated levels
+
+
+def make_grid_level(anchor, n_rows, n_cols, box_size, padding, box_type=NORMAL, hit_points=1):
+    """Return a level of equal boxes in a grid from anchor, column by column"""
+    level = np.zeros(n_rows * n_cols, dtype=BOX)
+    col, row = np.divmod(np.arange(n_rows * n_cols), n_rows)
+    level["x"] = anchor[0] + col * (box_size[0] + padding)
+    level["y"] = anchor[1] + row * (box_size[1] + padding)
+    level["width"], level["height"] = box_size
+    level["type"] = box_type
+    level["hit_points"] = hit_points
+    return level
+
+
+def generate_level(rng, area, box_size, padding, fill=0.8, weights=BOX_WEIGHTS):
+    """Return a random level filling an (x, y, width, height) area with boxes of a size
+
+    fill is the share of grid cells that get a box, the types of the
+    boxes are drawn with the weights.
+    """
+    x, y, width, height = area
+    n_cols = max((width + padding) // (box_size[0] + padding), 1)
+    n_rows = max((height + padding) // (box_size[1] + padding), 1)
+    level = make_grid_level((x, y), n_rows, n_cols, box_size, padding)
+    level = level[rng.random(len(level)) < fill]
+    level["type"] = rng.choice(len(weights), size=len(level), p=weights)
+    level["hit_points"] = np.where(level["type"] == HARD, rng.integers(2, MAX_HIT_POINTS, size=len(level), endpoint=True), 1)
+    return level
+
+
+def write_pack(path, levels):
+    """Write an iterable of levels to a pack file, one level at a time, return the number of levels
+
+    Every level needs a box that is not STEEL, boxpong clears a level when
+    its breakable boxes are gone and would skip one without any.
+    """
+    index = []
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        for level in levels:
+            level = np.asarray(level, dtype=BOX)
+            if not np.any(level["type"] != STEEL):
+                raise ValueError(f"level {len(index)} of {path} has no breakable boxes")
+            index.append((f.tell(), len(level)))
+            f.write(level.tobytes())
+        index_offset = f.tell()
+        f.write(np.array(index, dtype=INDEX).tobytes())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(index), index_offset))
+    return len(index)
+
+
+class LevelPack():
+    """Read-only view of a pack file, pack[i] is the array of records of level i
+
+    The arrays are views into the mapped file, nothing is read until
+    their elements are used.
+    """
+
+    def __init__(self, path):
+        if os.path.getsize(path) < HEADER.size:
+            raise ValueError(f"{path} is not a level pack")
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, version, n_levels, index_offset = HEADER.unpack(self.data[:HEADER.size].tobytes())
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a level pack")
+        if version != VERSION:
+            raise ValueError(f"{path} has level pack version {version}, expected {VERSION}")
+        self.index = self.data[index_offset:index_offset + n_levels * INDEX.itemsize].view(INDEX)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        offset, count = self.index[i].tolist()
+        return self.data[offset:offset + count * BOX.itemsize].view(BOX)
+
+
+class LevelStream():
+    """Plays the levels of a pack in order, starting over after the last one
+
+    prepare is called in a background thread with the records of a level
+    read into memory, and next() returns its result. While a level is
+    played the next one is already being prepared, so next() normally
+    returns at once. stall is how long the last next() had to wait.
+    """
+
+    def __init__(self, pack, prepare, start=0):
+        if len(pack) == 0:
+            raise ValueError(f"{pack.path} has no levels")
+        self.pack = pack
+        self.prepare = prepare
+        self.index = start % len(pack)
+        self.stall = 0.0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="levels")
+        self.pending = self.executor.submit(self.load, self.index)
+
+    def load(self, index):
+        return self.prepare(np.array(self.pack[index]))
+
+    def next(self):
+        """Return the prepared level and start preparing the one after it"""
+        start = time.perf_counter()
+        level = self.pending.result()
+        self.stall = time.perf_counter() - start
+        self.index = (self.index + 1) % len(self.pack)
+        self.pending = self.executor.submit(self.load, self.index)
+        return level
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    import boxpong
+    from timestep import LOGIC_RATE
+
+    parser = argparse.ArgumentParser(description="Generate boxpong level packs, and time how fast their levels load")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    generate = subparsers.add_parser("generate", help="write a pack of random levels")
+    generate.add_argument("pack")
+    generate.add_argument("--levels", type=int, default=100)
+    generate.add_argument("--box-size", type=int, nargs=2, default=boxpong.BOX_SIZE, metavar=("WIDTH", "HEIGHT"))
+    generate.add_argument("--fill", type=float, default=0.8, help="share of the grid cells that get a box")
+    generate.add_argument("--seed", type=int, default=None)
+    bench = subparsers.add_parser("bench", help="stream the levels of a pack and time their preparation")
+    bench.add_argument("pack")
+    bench.add_argument("--frames", type=int, default=10, help="logic steps played on each level before the next one")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        rng = np.random.default_rng(args.seed)
+        area = (boxpong.MARGIN, boxpong.MARGIN, boxpong.SCREEN_SIZE.width - 2 * boxpong.MARGIN, boxpong.SCREEN_SIZE.height // 2)
+        levels = (generate_level(rng, area, args.box_size, boxpong.BOX_PADDING, args.fill) for _ in range(args.levels))
+        start = time.perf_counter()
+        try:
+            n_levels = write_pack(args.pack, levels)
+        except ValueError as e:
+            parser.error(f"{e}, use a larger --fill")
+        print(f"{n_levels} levels, {os.path.getsize(args.pack) / 1e6:.1f} MB written in {time.perf_counter() - start:.2f} s")
+    else:
+        start = time.perf_counter()
+        pack = LevelPack(args.pack)
+        print(f"{len(pack)} levels opened in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        start = time.perf_counter()
+        boxpong.prepare_level(np.array(pack[0]))
+        print(f"preparing one level of {len(pack[0])} boxes takes {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        # Levels are played like in the game loop, a step every 1 / LOGIC_RATE seconds
+        game = boxpong.Game(LevelStream(pack, boxpong.prepare_level))
+        stalls = []
+        longest = 0.0
+        for _ in range(len(pack)):
+            for frame in range(args.frames):
+                start = time.perf_counter()
+                game.step(launch=frame == 0)
+                if frame == args.frames - 1:
+                    game.start_stage(game.next_stage())
+                    stalls.append(game.levels.stall)
+                duration = time.perf_counter() - start
+                longest = max(longest, duration)
+                time.sleep(max(1 / LOGIC_RATE - duration, 0))
+        game.levels.close()
+        stalls.sort()
+        print(f"waited for the next level: median {stalls[len(stalls) // 2] * 1000:.2f} ms, max {stalls[-1] * 1000:.2f} ms")
+        print(f"longest step: {longest * 1000:.1f} ms")
@@ -0,0 +1,275 @@
+"""Server for many pong matches in one process, with a bot load generator
+
+Clients talk the protocol of netpong.py, so netpong clients can join.
+Every pair of clients that joins gets a match, all matches are slots of
+one BatchPong and the running ones are stepped together once per tick.
+
+- Each tick has a budget of TICK_BUDGET of the tick interval. A tick
+  that overruns it makes the server send snapshots less often, until
+  ticks fit again for a second
+- Every match gets a budget of its share of the tick: the cost of each
+  tick is divided among the running matches, and a new match is only
+  started while the worst cost per match of the last second, times the
+  running matches and the new one, fits into the tick budget and no tick
+  overran recently. Other clients get a FULL answer to their join
+  requests
+- Ticks per second and percentiles of the tick time and of how late
+  ticks started are printed every few seconds
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import random
+import time
+from collections import deque
+
+import numpy as np
+
+import netpong
+import pong
+from batchpong import BatchPong
+from netpong import INPUT, INPUT_PACKET, JOIN, SNAPSHOT, SNAPSHOT_PACKET, WELCOME, WELCOME_PACKET, UP, DOWN, percentile
+from timestep import LOGIC_RATE, MAX_STEPS
+
+FULL = b"F"
+
+MAX_MATCHES = 1000
+TICK_BUDGET = 0.5  # Fraction of the tick interval the ticks may take, the rest is left for receiving packets
+MAX_SNAPSHOT_INTERVAL = 8  # Ticks between snapshots when the server is overloaded
+PLAYER_TIMEOUT = 5.0  # Seconds without input after which a player is dropped
+REPORT_INTERVAL = 5.0
+
+
+class MatchServer(asyncio.DatagramProtocol):
+    def __init__(self, max_matches=MAX_MATCHES, seed=None):
+        self.batch = BatchPong(max_matches, seed=seed)
+        self.keys = np.zeros((max_matches, 2), dtype=np.uint8)
+        self.running = np.zeros(max_matches, dtype=bool)
+        self.ticks = np.zeros(max_matches, dtype=np.int64)
+        self.seats = [[None, None] for _ in range(max_matches)]  # addresses of the players of every match
+        self.players = {}  # address -> (match, side)
+        self.inputs = {}  # address -> (input number, client time, server time) of the newest input
+        self.transport = None
+
+        self.budget = TICK_BUDGET / LOGIC_RATE
+        self.snapshot_interval = 1
+        self.calm_ticks = 0
+        self.tick = 0
+        self.tick_times = deque(maxlen=LOGIC_RATE * 10)
+        self.match_costs = deque(maxlen=LOGIC_RATE)  # Seconds per running match of the ticks of the last second
+        self.lateness = deque(maxlen=LOGIC_RATE * 10)
+        self.overruns = self.refused = self.packets_in = self.packets_out = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self.packets_in += 1
+        kind = data[:1]
+        if kind == JOIN:
+            if address not in self.players and not self.seat(address):
+                self.refused += 1
+                self.send(FULL, address)
+                return
+            match, side = self.players[address]
+            self.send(WELCOME_PACKET.pack(WELCOME, side), address)
+        elif kind == INPUT and address in self.players and len(data) == INPUT_PACKET.size:
+            _, number, keys, sent = INPUT_PACKET.unpack(data)
+            if number > self.inputs.get(address, (0,))[0]:
+                self.inputs[address] = (number, sent, time.perf_counter())
+                self.keys[self.players[address]] = keys
+
+    def send(self, data, address):
+        self.packets_out += 1
+        self.transport.sendto(data, address)
+
+    def accepting(self):
+        """Return True if one more match fits into the tick budget at the worst recent cost per match"""
+        if self.snapshot_interval > 1:
+            return False
+        if len(self.match_costs) < LOGIC_RATE:
+            return True
+        n_running = int(np.count_nonzero(self.running))
+        return max(self.match_costs) * (n_running + 1) < self.budget
+
+    def seat(self, address):
+        """Give a joining player a seat, in a match that waits for an opponent if there is one"""
+        waiting = [m for m, seats in enumerate(self.seats) if seats.count(None) == 1]
+        if waiting:
+            match = waiting[0]
+        elif self.accepting():
+            empty = [m for m, seats in enumerate(self.seats) if seats == [None, None]]
+            if not empty:
+                return False
+            match = empty[0]
+        else:
+            return False
+
+        side = self.seats[match].index(None)
+        self.seats[match][side] = address
+        self.players[address] = (match, side)
+        self.inputs[address] = (0, 0.0, time.perf_counter())
+        if None not in self.seats[match]:
+            mask = np.zeros(len(self.running), dtype=bool)
+            mask[match] = True
+            self.batch.reset(mask)
+            self.ticks[match] = 0
+            self.running[match] = True
+        return True
+
+    def drop_idle_players(self):
+        now = time.perf_counter()
+        for address, (number, sent, received) in list(self.inputs.items()):
+            if now - received > PLAYER_TIMEOUT:
+                match, side = self.players.pop(address)
+                del self.inputs[address]
+                self.seats[match][side] = None
+                self.keys[match, side] = 0
+                self.running[match] = False
+
+    def step(self):
+        start = time.perf_counter()
+        n_running = int(np.count_nonzero(self.running))
+        keys = self.keys
+        self.batch.step(keys[:, 0] & UP, keys[:, 0] & DOWN, keys[:, 1] & UP, keys[:, 1] & DOWN, mask=self.running)
+        self.ticks += self.running
+        if self.tick % self.snapshot_interval == 0:
+            self.send_snapshots()
+        if self.tick % LOGIC_RATE == 0:
+            self.drop_idle_players()
+        self.tick += 1
+
+        duration = time.perf_counter() - start
+        self.tick_times.append(duration)
+        if n_running:
+            self.match_costs.append(duration / n_running)
+        self.apply_backpressure(duration)
+
+    def apply_backpressure(self, duration):
+        """Send snapshots less often while ticks overrun the budget, and more often again once they fit"""
+        if duration > self.budget:
+            self.overruns += 1
+            self.calm_ticks = 0
+            self.snapshot_interval = min(self.snapshot_interval * 2, MAX_SNAPSHOT_INTERVAL)
+        else:
+            self.calm_ticks += 1
+            if self.calm_ticks >= LOGIC_RATE and self.snapshot_interval > 1:
+                self.snapshot_interval //= 2
+                self.calm_ticks = 0
+
+    def send_snapshots(self):
+        """Send every player the state of its match, players waiting for an opponent included"""
+        batch = self.batch
+        players = list(self.players.items())
+        index = np.array([match for _, (match, _) in players], dtype=np.int64)
+        rows = zip(self.ticks[index].tolist(), batch.ball_x[index].tolist(), batch.ball_y[index].tolist(),
+            batch.ball_vx[index].tolist(), batch.ball_vy[index].tolist(), batch.bat_left_y[index].tolist(),
+            batch.bat_right_y[index].tolist(), (batch.score_left[index] % 256).tolist(), (batch.score_right[index] % 256).tolist())
+        for (address, _), (tick, x, y, vx, vy, left_y, right_y, score_left, score_right) in zip(players, rows):
+            number, sent, received = self.inputs[address]
+            self.send(SNAPSHOT_PACKET.pack(SNAPSHOT, tick, number, sent, x, y, vx, vy, left_y, right_y, score_left, score_right), address)
+
+    def report(self, elapsed, ticks, packets_in, packets_out):
+        tick_ms = [t * 1000 for t in self.tick_times]
+        late_ms = [t * 1000 for t in self.lateness]
+        return (
+            f"matches {int(np.count_nonzero(self.running))}  players {len(self.players)}  "
+            f"ticks/s {ticks / elapsed:.1f}  "
+            f"tick p50 {percentile(tick_ms, 50):.2f} p95 {percentile(tick_ms, 95):.2f} p99 {percentile(tick_ms, 99):.2f} ms  "
+            f"late p95 {percentile(late_ms, 95):.1f} ms  "
+            f"overruns {self.overruns}  snapshot every {self.snapshot_interval}  refused {self.refused}  "
+            f"packets in/out {packets_in / elapsed:.0f}/{packets_out / elapsed:.0f} per s"
+        )
+
+    async def run(self, duration=None):
+        """Tick LOGIC_RATE times per second, after a long stall the ticks that were missed are dropped"""
+        start = next_tick = last_report = time.perf_counter()
+        counts = (self.tick, self.packets_in, self.packets_out)
+        while duration is None or time.perf_counter() - start < duration:
+            self.lateness.append(max(time.perf_counter() - next_tick, 0))
+            self.step()
+
+            now = time.perf_counter()
+            next_tick += 1 / LOGIC_RATE
+            if now - next_tick > MAX_STEPS / LOGIC_RATE:
+                next_tick = now
+            if now - last_report >= REPORT_INTERVAL:
+                new_counts = (self.tick, self.packets_in, self.packets_out)
+                print(self.report(now - last_report, *(new - old for new, old in zip(new_counts, counts))), flush=True)
+                last_report, counts = now, new_counts
+            await asyncio.sleep(max(next_tick - now, 0))
+
+
+async def serve(port, max_matches=MAX_MATCHES, duration=None):
+    server = MatchServer(max_matches)
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(lambda: server, local_addr=("0.0.0.0", port))
+    print(f"serving up to {max_matches} matches on port {port}", flush=True)
+    try:
+        await server.run(duration)
+    finally:
+        transport.close()
+
+
+async def load(host, port, n_clients, seconds, seed=None):
+    """Connect CPU players to a server, play for a number of seconds and print what they saw"""
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    clients = [netpong.Client(pong.CPUController(**pong.DIFFICULTIES["normal"], seed=rng.random())) for _ in range(n_clients)]
+    transports = []
+    for client in clients:
+        transport, _ = await loop.create_datagram_endpoint(lambda client=client: client, remote_addr=(host, port))
+        transports.append(transport)
+
+    async def play(client):
+        try:
+            await asyncio.wait_for(client.run(seconds), seconds + 1)
+        except asyncio.TimeoutError:
+            pass
+    await asyncio.gather(*(play(client) for client in clients))
+    for transport in transports:
+        transport.close()
+
+    joined = [client for client in clients if client.side is not None]
+    rtt = [t * 1000 for client in joined for t in client.round_trips]
+    snapshots = sum(client.snapshots_received for client in joined)
+    print(f"bots {len(joined)} of {n_clients} joined  snapshots {snapshots / max(len(joined), 1) / seconds:.1f} per bot per s  "
+        f"rtt p50 {percentile(rtt, 50):.1f} p95 {percentile(rtt, 95):.1f} p99 {percentile(rtt, 99):.1f} ms", flush=True)
+
+
+def run_server(port, max_matches, duration):
+    asyncio.run(serve(port, max_matches, duration))
+
+
+def run_load(host, port, n_clients, seconds, seed):
+    asyncio.run(load(host, port, n_clients, seconds, seed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Host many pong matches in one process, or load test such a server")
+    parser.add_argument("mode", choices=("server", "load", "bench"),
+        help="run a server, connect bots to one, or run a server and bots on this machine")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=netpong.PORT)
+    parser.add_argument("--matches", type=int, default=MAX_MATCHES, help="most matches the server hosts")
+    parser.add_argument("--clients", type=int, default=200, help="number of bots")
+    parser.add_argument("--processes", type=int, default=1, help="processes the bots are spread over")
+    parser.add_argument("--seconds", type=float, default=20.0, help="how long the bots play")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.mode == "server":
+        asyncio.run(serve(args.port, args.matches))
+    else:
+        processes = []
+        if args.mode == "bench":
+            processes.append(multiprocessing.Process(target=run_server, args=(args.port, args.matches, args.seconds + 3)))
+            processes[0].start()
+            time.sleep(1)
+        for i in range(args.processes):
+            n_clients = args.clients // args.processes + (i < args.clients % args.processes)
+            seed = None if args.seed is None else args.seed + i
+            processes.append(multiprocessing.Process(target=run_load, args=(args.host, args.port, n_clients, args.seconds, seed)))
+            processes[-1].start()
+        for process in processes:
+            process.join()
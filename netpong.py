@@ -0,0 +1,403 @@
+"""Two-player pong over UDP with an authoritative server
+
+- The server runs the only real pong.Match and sends a snapshot of it to
+  both players after every step
+- Clients send their keys every frame. The server moves a bat every tick
+  with the keys of the newest input it received from its player, the
+  client predicts the own bat the same way on top of the last snapshot,
+  the ball and the other bat are interpolated between snapshots from a
+  little in the past
+- LossyTransport delays and drops outgoing packets, so all of this can
+  be tried on one machine, e.g. with the loopback command
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import struct
+import time
+from collections import deque
+
+import pygame as pg
+
+import pong
+from timestep import LOGIC_RATE, MAX_INTERPOLATION
+
+PORT = 50007
+JOIN_INTERVAL = 0.25  # Seconds between join requests until the server answers
+INTERPOLATION_DELAY = 0.1  # Seconds the ball and the other bat are shown in the past
+
+JOIN, WELCOME, INPUT, SNAPSHOT = b"J", b"W", b"I", b"S"
+WELCOME_PACKET = struct.Struct("<cB")  # side: 0 left, 1 right
+INPUT_PACKET = struct.Struct("<cIBd")  # input number, keys, client time when sent
+# tick, last input number received from this client and its client time,
+# ball position and movement, bat heights, score
+SNAPSHOT_PACKET = struct.Struct("<cIIdffffhhBB")
+
+UP, DOWN = 1, 2
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+class LossyTransport():
+    """Datagram transport that delays every packet and drops some of them
+
+    - Every packet is delayed by latency plus up to jitter seconds, so
+      packets can arrive out of order
+    - loss is the fraction of packets that are dropped
+    """
+
+    def __init__(self, transport, latency=0.0, jitter=0.0, loss=0.0, rng=None):
+        self.transport = transport
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = rng if rng is not None else random.Random()
+        self.packets_sent = self.bytes_sent = self.dropped = 0
+
+    def sendto(self, data, address=None):
+        self.packets_sent += 1
+        self.bytes_sent += len(data)
+        if self.loss and self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.send_now, data, address)
+        else:
+            self.send_now(data, address)
+
+    def send_now(self, data, address):
+        if not self.transport.is_closing():
+            self.transport.sendto(data, address)
+
+    def close(self):
+        self.transport.close()
+
+
+async def run_ticks(tick, duration=None):
+    """Call tick() LOGIC_RATE times per second until it returns False or the duration is over"""
+    start = next_tick = time.perf_counter()
+    while duration is None or time.perf_counter() - start < duration:
+        if tick() is False:
+            return
+        next_tick += 1 / LOGIC_RATE
+        await asyncio.sleep(max(next_tick - time.perf_counter(), 0))
+
+
+class Server(asyncio.DatagramProtocol):
+    """Runs a match for the first two clients that join, the match starts when both are there"""
+
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, seed=None):
+        self.match = pong.Match()
+        self.players = {}  # address -> side
+        self.keys = [0, 0]
+        self.inputs = {}  # address -> (input number, client time) of the newest input
+        self.shim = (latency, jitter, loss, random.Random(seed))
+        self.transport = None
+        self.tick = 0
+
+    def connection_made(self, transport):
+        self.transport = LossyTransport(transport, *self.shim)
+
+    def datagram_received(self, data, address):
+        kind = data[:1]
+        if kind == JOIN:
+            if address not in self.players and len(self.players) < 2:
+                self.players[address] = 1 - min(self.players.values(), default=1)
+            if address in self.players:
+                self.transport.sendto(WELCOME_PACKET.pack(WELCOME, self.players[address]), address)
+        elif kind == INPUT and address in self.players and len(data) == INPUT_PACKET.size:
+            _, number, keys, sent = INPUT_PACKET.unpack(data)
+            # Inputs that arrive after a newer one are out of date
+            if number > self.inputs.get(address, (0, 0.0))[0]:
+                self.inputs[address] = (number, sent)
+                self.keys[self.players[address]] = keys
+
+    def step(self):
+        if len(self.players) == 2:
+            left, right = self.keys
+            self.match.step(left & UP, left & DOWN, right & UP, right & DOWN)
+            self.tick += 1
+        for address in self.players:
+            self.transport.sendto(self.get_snapshot(*self.inputs.get(address, (0, 0.0))), address)
+
+    def get_snapshot(self, number, sent):
+        match = self.match
+        return SNAPSHOT_PACKET.pack(
+            SNAPSHOT, self.tick, number, sent,
+            *match.ball.position, *match.ball.movement,
+            match.bat_left.rect.y, match.bat_right.rect.y,
+            match.scoreboard.score_left % 256, match.scoreboard.score_right % 256,
+        )
+
+    async def run(self, duration=None):
+        await run_ticks(self.step, duration)
+
+
+class Client(asyncio.DatagramProtocol):
+    """One player, sending keys and keeping match as its view of the server's match
+
+    controller(match, bat) returns the (up, down) keys for every frame,
+    like the controllers of pong.simulate.
+    """
+
+    def __init__(self, controller, latency=0.0, jitter=0.0, loss=0.0, seed=None):
+        self.controller = controller
+        self.match = pong.Match()
+        self.side = None
+        self.shim = (latency, jitter, loss, random.Random(seed))
+        self.transport = None
+
+        self.number = 0
+        self.pending = deque()  # (input number, keys, client time when sent) the server has not confirmed yet
+        self.held = 0  # Keys of the newest input the server confirmed, it moves the bat with them until a newer one arrives
+        self.confirmed_tick = 0  # Tick of the first snapshot that confirmed that input
+        self.own_y = None  # Own bat height in the latest snapshot
+        self.frame_time = 0.0  # Client time of the last frame
+        self.snapshots = deque(maxlen=LOGIC_RATE)  # (tick, ball x, ball y, other bat y) of recent snapshots
+        self.latest = None
+        self.received_at = 0.0
+
+        self.round_trips = []
+        self.snapshots_received = 0
+        self.snapshots_late = 0
+        self.corrections = []
+
+    @property
+    def bat(self):
+        return self.match.bat_left if self.side == 0 else self.match.bat_right
+
+    @property
+    def other_bat(self):
+        return self.match.bat_right if self.side == 0 else self.match.bat_left
+
+    def connection_made(self, transport):
+        self.transport = LossyTransport(transport, *self.shim)
+
+    def datagram_received(self, data, address):
+        kind = data[:1]
+        if kind == WELCOME and len(data) == WELCOME_PACKET.size:
+            self.side = WELCOME_PACKET.unpack(data)[1]
+        elif kind == SNAPSHOT and len(data) == SNAPSHOT_PACKET.size and self.side is not None:
+            snapshot = SNAPSHOT_PACKET.unpack(data)
+            # A snapshot that arrives after a newer one is out of date, before the
+            # match starts snapshots may repeat the last one
+            if self.latest is not None and snapshot[1:3] <= self.latest[1:3]:
+                self.snapshots_late += snapshot[1:3] < self.latest[1:3]
+                return
+            self.snapshots_received += 1
+            # Only the first snapshot that confirms an input tells its round trip time
+            if snapshot[2] > (self.latest[2] if self.latest is not None else 0):
+                self.round_trips.append(time.perf_counter() - snapshot[3])
+            self.apply(snapshot)
+
+    def apply(self, snapshot):
+        """Take over the state of a snapshot and predict the own bat from there"""
+        _, tick, number, sent, ball_x, ball_y, movement_x, movement_y, left_y, right_y, score_left, score_right = snapshot
+        # Only a bat that was predicted in a started match can be corrected
+        started = self.latest is not None and self.latest[1] > 0 and self.latest[2] > 0
+        if number > (self.latest[2] if self.latest is not None else 0):
+            self.confirmed_tick = tick
+        self.latest = snapshot
+        self.received_at = time.perf_counter()
+        self.match.frame = tick
+        self.match.ball.movement = pg.math.Vector2(movement_x, movement_y)
+        self.match.scoreboard.score_left, self.match.scoreboard.score_right = score_left, score_right
+        own_y, other_y = (left_y, right_y) if self.side == 0 else (right_y, left_y)
+        if not self.snapshots or tick > self.snapshots[-1][0]:
+            self.snapshots.append((tick, ball_x, ball_y, other_y))
+
+        while self.pending and self.pending[0][0] <= number:
+            self.held = self.pending.popleft()[1]
+        predicted_y = self.bat.rect.y
+        self.own_y = own_y
+        # A snapshot from after the last frame shows where the bat went since, that is no correction
+        if self.predict() and started and self.bat.rect.y != predicted_y:
+            self.corrections.append(abs(self.bat.rect.y - predicted_y))
+
+    def predict(self):
+        """Move the own bat to where the server has it once the input of the last frame arrived
+
+        - Like the server, every tick after the latest snapshot moves the bat
+          with the keys of the newest input that arrived by then
+        - Inputs are assumed to take as long to arrive as the confirmed one,
+          which arrived between the tick the server first confirmed it in and
+          the tick before, so the client time of every tick can be told
+        - Clients whose frames are slower or faster than the ticks are
+          predicted as well as clients that send an input every tick
+        - The server moves no bat before the match starts
+
+        Return False if the latest snapshot is from after the input of the
+        last frame arrived, the bat is put where the snapshot has it then.
+        """
+        if self.own_y is None:
+            return False
+        self.bat.rect.y = self.own_y
+        _, tick, number, confirmed_sent = self.latest[:4]
+        if tick == 0 or number == 0:
+            return False
+
+        def ticks_after_snapshot(sent):
+            """Ticks after the snapshot in which an input sent at this client time arrives"""
+            return (sent - confirmed_sent) * LOGIC_RATE - (tick - self.confirmed_tick) - 0.5
+
+        n_ticks = math.ceil(ticks_after_snapshot(self.frame_time))
+        keys = self.held
+        pending = iter(self.pending)
+        _, next_keys, sent = next(pending, (None, None, None))
+        for n in range(1, n_ticks + 1):
+            while sent is not None and ticks_after_snapshot(sent) <= n:
+                keys = next_keys
+                _, next_keys, sent = next(pending, (None, None, None))
+            self.bat.move(up=keys & UP, down=keys & DOWN)
+        return n_ticks >= 0
+
+    def interpolate(self):
+        """Move the ball and the other bat to where they were INTERPOLATION_DELAY ago"""
+        if not self.snapshots:
+            return
+        latest_tick = self.snapshots[-1][0]
+        tick = latest_tick + (time.perf_counter() - self.received_at - INTERPOLATION_DELAY) * LOGIC_RATE
+        before = after = self.snapshots[-1]
+        for snapshot in reversed(self.snapshots):
+            if snapshot[0] <= tick:
+                before = snapshot
+                break
+            after = snapshot
+        if before is after or abs(after[1] - before[1]) + abs(after[2] - before[2]) > MAX_INTERPOLATION:
+            _, ball_x, ball_y, other_y = before
+        else:
+            alpha = (tick - before[0]) / (after[0] - before[0])
+            ball_x, ball_y, other_y = (old + (new - old) * alpha for old, new in zip(before[1:], after[1:]))
+
+        self.match.ball.position.update(ball_x, ball_y)
+        self.match.ball.rect.topleft = (round(ball_x), round(ball_y))
+        self.other_bat.rect.y = round(other_y)
+
+    def step(self):
+        """Send the keys of this frame and predict the own bat with them right away"""
+        up, down = self.controller(self.match, self.bat)
+        keys = (UP if up else 0) | (DOWN if down else 0)
+        self.number += 1
+        self.frame_time = time.perf_counter()
+        self.pending.append((self.number, keys, self.frame_time))
+        self.predict()
+        self.transport.sendto(INPUT_PACKET.pack(INPUT, self.number, keys, self.frame_time))
+        self.interpolate()
+
+    async def join(self):
+        while self.side is None:
+            self.transport.sendto(JOIN)
+            await asyncio.sleep(JOIN_INTERVAL)
+
+    async def run(self, duration=None, draw=None):
+        """Join and play, draw() is called after every frame and stops the client by returning False"""
+        await self.join()
+
+        def tick():
+            self.step()
+            if draw is not None:
+                return draw()
+        await run_ticks(tick, duration)
+
+    def report(self):
+        """Return a line with the snapshot, round trip and prediction metrics"""
+        rtt = [t * 1000 for t in self.round_trips]
+        return (
+            f"{('left', 'right')[self.side]:<6} "
+            f"snapshots {self.snapshots_received} of {SNAPSHOT_PACKET.size} bytes, {self.snapshots_late} late  "
+            f"rtt p50 {percentile(rtt, 50):.1f} p95 {percentile(rtt, 95):.1f} max {percentile(rtt, 100):.1f} ms  "
+            f"corrections {len(self.corrections)} (mean {sum(self.corrections) / max(len(self.corrections), 1):.1f} px)  "
+            f"inputs sent {self.transport.bytes_sent / 1000:.1f} kB"
+        )
+
+
+async def loopback(seconds, latency, jitter, loss, seed=None):
+    """Play a match of two CPU players against a server on localhost and print the network metrics"""
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    server = Server(latency / 2, jitter / 2, loss, rng.random())
+    transport, _ = await loop.create_datagram_endpoint(lambda: server, local_addr=("127.0.0.1", 0))
+    address = transport.get_extra_info("sockname")
+
+    clients = [Client(pong.CPUController(**pong.DIFFICULTIES["normal"], seed=rng.random()), latency / 2, jitter / 2, loss, rng.random()) for _ in range(2)]
+    for client in clients:
+        await loop.create_datagram_endpoint(lambda client=client: client, remote_addr=address)
+
+    await asyncio.gather(server.run(seconds), *(client.run(seconds) for client in clients))
+
+    sent = server.transport
+    print(f"server  {server.tick} ticks, score {server.match.scoreboard.score_left} : {server.match.scoreboard.score_right}, "
+        f"{sent.bytes_sent / seconds / 1000:.1f} kB/s sent, {sent.dropped} of {sent.packets_sent} packets dropped")
+    for client in clients:
+        print(client.report())
+    for client in clients:
+        client.transport.close()
+    transport.close()
+
+
+async def serve(port, latency=0.0, jitter=0.0, loss=0.0):
+    loop = asyncio.get_running_loop()
+    server = Server(latency, jitter, loss)
+    transport, _ = await loop.create_datagram_endpoint(lambda: server, local_addr=("0.0.0.0", port))
+    print(f"serving on port {port}")
+    try:
+        await server.run()
+    finally:
+        transport.close()
+
+
+async def play(host, port, latency=0.0, jitter=0.0, loss=0.0):
+    """Play in a window with W/S or the arrow keys"""
+    pg.init()
+    screen = pg.display.set_mode(pong.SCREEN_SIZE, pg.SCALED)
+    pg.display.set_caption(f"{pong.GAME_TITLE} - {host}:{port}")
+    background = pg.Surface(screen.get_size()).convert()
+    background.fill(pong.BLACK)
+
+    def keyboard(match, bat):
+        keys = pg.key.get_pressed()
+        return keys[pg.K_w] or keys[pg.K_UP], keys[pg.K_s] or keys[pg.K_DOWN]
+
+    def draw():
+        for event in pg.event.get():
+            if event.type == pg.QUIT or (event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE):
+                return False
+        client.match.draw(screen, background)
+        pg.display.flip()
+
+    client = Client(keyboard, latency, jitter, loss)
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(lambda: client, remote_addr=(host, port))
+    try:
+        await client.run(draw=draw)
+    finally:
+        transport.close()
+        print(client.report())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Two-player pong over UDP")
+    parser.add_argument("mode", choices=("server", "client", "loopback"),
+        help="run a server, join one in a window, or play two CPU players against a local server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every round trip")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds are randomly added to every round trip")
+    parser.add_argument("--loss", type=float, default=0.0, help="fraction of packets dropped in each direction")
+    parser.add_argument("--seconds", type=float, default=10.0, help="how long the loopback match runs")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.mode == "server":
+        asyncio.run(serve(args.port, args.latency / 2, args.jitter / 2, args.loss))
+    elif args.mode == "client":
+        asyncio.run(play(args.host, args.port, args.latency / 2, args.jitter / 2, args.loss))
+    else:
+        asyncio.run(loopback(args.seconds, args.latency, args.jitter, args.loss, args.seed))
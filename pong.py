@@ -1,9 +1,11 @@
 import pygame as pg
-from collections import namedtuple
-from random import randint, choice
+import argparse
+from random import Random, randint, choice
 
-Position = namedtuple("Position", "x y")
-Size = namedtuple("Size", "width height")
+import sweep
+from engine import Entity, EntityGroup, Position, Size, add_common_arguments, open_game
+from rendercache import blit_all, get_font, render_text
+from timestep import interpolate, snapshot
 
 GAME_TITLE = "Pong"
 
@@ -17,16 +19,31 @@ BAT_SPEED = 7
 BALL_SIZE = Size(15, 15)
 BALL_SPEED = 10
 
+# Reaction delay in frames and largest aiming error in pixels of the computer player
+DIFFICULTIES = {
+    "easy": {"reaction_delay": 40, "error": 160},
+    "normal": {"reaction_delay": 20, "error": 115},
+    "hard": {"reaction_delay": 0, "error": 0},
+}
+
 TEXT_SIZE = 40
 TEXT_POSITION = Position(MIDDLE.x, 10)
 
 BLACK = pg.Color("black")
 WHITE = pg.Color("white")
 
+# Solid areas above and below the screen that the ball bounces off
+WALLS = (
+    sweep.Box(-SCREEN_SIZE.width, -SCREEN_SIZE.height, 3 * SCREEN_SIZE.width, SCREEN_SIZE.height),
+    sweep.Box(-SCREEN_SIZE.width, SCREEN_SIZE.height, 3 * SCREEN_SIZE.width, SCREEN_SIZE.height),
+)
+
+
+class Bat(Entity):
+    __slots__ = ("speed",)
 
-class Bat(pg.sprite.Sprite):
     def __init__(self, position):
-        pg.sprite.Sprite.__init__(self)
+        Entity.__init__(self)
         self.image = pg.Surface(BAT_SIZE)
         self.image.fill(WHITE)
         self.rect = pg.Rect(position, (self.image.get_width(),self.image.get_height()))
@@ -40,9 +57,11 @@ class Bat(pg.sprite.Sprite):
             self.rect.move_ip(0, self.speed)
 
 
-class Ball(pg.sprite.Sprite):
+class Ball(Entity):
+    __slots__ = ("position", "movement")
+
     def __init__(self):
-        pg.sprite.Sprite.__init__(self)
+        Entity.__init__(self)
 
         self.image = pg.Surface(BALL_SIZE)
         self.image.fill(WHITE)
@@ -51,17 +70,17 @@ class Ball(pg.sprite.Sprite):
 
         self.reset()
  
-    def move(self):
-        """Move the ball, bounce of the top or bottom of screen"""
-        if self.rect.top <= 0 or self.rect.bottom >= SCREEN_SIZE.height:
-            self.movement.y = -self.movement.y
-        
-        self.rect.move_ip(self.movement.x, self.movement.y)
-    
-    def collide(self, bat):
-        """Change direction if the ball collides with a bat"""
-        if self.rect.colliderect(bat.rect):
-            self.movement.x = - self.movement.x
+    def move(self, targets=WALLS):
+        """Move the ball, bounce of the targets: the walls at the top and bottom of screen and the bats
+
+        Contacts are found along the whole path of the frame, so the ball
+        can not pass through a bat. Return the (sprite or wall, normal) contacts.
+        """
+        (x, y), movement, contacts = sweep.bounce((*self.position, *BALL_SIZE), self.movement, targets)
+        self.movement.update(movement)
+        self.position.update(x, y)
+        self.rect.topleft = (round(x), round(y))
+        return contacts
 
     def is_outside_screen_left(self):
         """Return True if the ball is outside the left side of the screen"""
@@ -78,6 +97,7 @@ class Ball(pg.sprite.Sprite):
 
     def set_position(self, position):
         self.rect.center = position
+        self.position = pg.math.Vector2(self.rect.topleft)
     
     def set_random_direction(self):
         """Set movement of the ball to a random direction, that goes left or right"""
@@ -89,85 +109,224 @@ class Ball(pg.sprite.Sprite):
 class Scoreboard():
     def __init__(self):
         self.score_left = self.score_right = 0
-        self.font = pg.font.SysFont("corbel", TEXT_SIZE, bold=True)
+        self.font = None
     
     def get_text(self):
         """Return the font and the score"""
+        if self.font is None:
+            # Loaded on first use, so headless matches never touch pg.font
+            self.font = get_font("corbel", TEXT_SIZE, bold=True)
         text = f"{self.score_left} : {self.score_right}"
         return self.font, text
+
+    def get_image(self):
+        """Return the rendered score and its position, only rendered again when the score changed"""
+        font, text = self.get_text()
+        image = render_text(text, font, WHITE)
+        return image, image.get_rect(centerx=TEXT_POSITION.x, y=TEXT_POSITION.y)
     
     def point_left(self):
         self.score_left += 1
     
     def point_right(self):
         self.score_right += 1
-        
 
-def main():
-    pg.init()
-    pg.font.init()
-    screen = pg.display.set_mode(SCREEN_SIZE, pg.SCALED)
-    pg.display.set_caption(GAME_TITLE)
-    pg.mouse.set_visible(False)
 
-    clock = pg.time.Clock()
-
-    background = pg.Surface(screen.get_size())
-    background = background.convert()
-    background.fill(BLACK)
-
-    ball = Ball()
-    bat_left = Bat((MARGIN, MIDDLE.y))
-    bat_right = Bat((SCREEN_SIZE.width - MARGIN - BAT_SIZE.width, MIDDLE.y))
-    scoreboard = Scoreboard()
-
-    allsprites = pg.sprite.Group(ball, bat_left, bat_right)
-
-    while True:
-        # Player input here
-        #------------------
-        keys = pg.key.get_pressed()
-        if keys[pg.K_w]:
-            bat_left.move(up=True)
-        if keys[pg.K_s]:
-            bat_left.move(down=True)
-        if keys[pg.K_UP]:
-            bat_right.move(up=True)
-        if keys[pg.K_DOWN]:
-            bat_right.move(down=True)
-
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                return
-            elif event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:
-                return
-        
-        # Logical updates here
-        #---------------------
-        if ball.is_outside_screen_left():
-            scoreboard.point_right()
-            ball.reset()
-        elif ball.is_outside_screen_right():
-            scoreboard.point_left()
-            ball.reset()
-
-        ball.collide(bat_left)
-        ball.collide(bat_right)
-        ball.move()
-
-        # Render graphics here
-        #---------------------
+class Match():
+    """Ball, bats and scoreboard of one game, advanced one frame at a time
+
+    A match needs no window, no clock and no font, so it can be stepped
+    as fast as the CPU allows by bots, scripts or the regular game loop.
+    """
+
+    def __init__(self):
+        self.ball = Ball()
+        self.bat_left = Bat((MARGIN, MIDDLE.y))
+        self.bat_right = Bat((SCREEN_SIZE.width - MARGIN - BAT_SIZE.width, MIDDLE.y))
+        self.scoreboard = Scoreboard()
+        self.allsprites = EntityGroup(self.ball, self.bat_left, self.bat_right)
+        self.targets = (*WALLS, self.bat_left, self.bat_right)  # What the ball bounces off
+        self.previous = {}
+        self.contacts = []
+        self.frame = 0
+
+    def step(self, left_up=False, left_down=False, right_up=False, right_down=False):
+        """Advance the match by one frame
+
+        Return "left" or "right" if that player scored a point, else None.
+        The (sprite or wall, normal) contacts of the ball in this frame are
+        kept in contacts.
+        """
+        self.previous = snapshot(self.allsprites)
+        self.bat_left.move(up=left_up, down=left_down)
+        self.bat_right.move(up=right_up, down=right_down)
+
+        scorer = None
+        if self.ball.is_outside_screen_left():
+            self.scoreboard.point_right()
+            self.ball.reset()
+            scorer = "right"
+        elif self.ball.is_outside_screen_right():
+            self.scoreboard.point_left()
+            self.ball.reset()
+            scorer = "left"
+
+        self.contacts = self.ball.move(self.targets)
+
+        self.frame += 1
+        return scorer
+
+    def get_state(self):
+        """Return the frame, the score and where the ball and the bats are"""
+        return {
+            "frame": self.frame,
+            "score": [self.scoreboard.score_left, self.scoreboard.score_right],
+            "ball": list(self.ball.rect.topleft),
+            "bats": [self.bat_left.rect.y, self.bat_right.rect.y],
+        }
+
+    def draw(self, screen, background, alpha=1.0):
+        """Draw the background, the score and all sprites
+
+        alpha is how far the sprites are drawn from their position before
+        the last step to their current one.
+        """
         screen.blit(background, (0, 0))
+        screen.blit(*self.scoreboard.get_image())
+        blit_all(screen, interpolate(self.allsprites, self.previous, alpha))
+
+    def draw_dirty(self, renderer, alpha=1.0):
+        """Redraw the bats and the ball where they moved and the score, return the changed areas"""
+        return renderer.draw(
+            overlays=[self.scoreboard.get_image()],
+            moving=interpolate(self.allsprites, self.previous, alpha),
+        )
+
+
+def idle(match, bat):
+    """Controller that never moves its bat"""
+    return False, False
+
 
-        font, text = scoreboard.get_text()
-        text_surface = font.render(text, True, WHITE)
-        textpos = text_surface.get_rect(centerx=TEXT_POSITION.x, y=TEXT_POSITION.y)
-        screen.blit(text_surface, textpos)
+def follow_ball(match, bat):
+    """Controller that moves its bat towards the ball's height"""
+    return match.ball.rect.centery < bat.rect.centery, match.ball.rect.centery > bat.rect.centery
 
-        allsprites.draw(screen)
-        pg.display.flip()
-        clock.tick(60)
+
+def intercept_y(edge_x, ball_y, movement_x, movement_y, face_x):
+    """Return the top of the ball when its leading edge reaches face_x
+
+    The bounces off the top and bottom of the screen are unfolded, so the
+    result follows from the movement without simulating frame by frame.
+    Works on floats as well as on NumPy arrays.
+    """
+    frames = (face_x - edge_x) / movement_x
+    span = SCREEN_SIZE.height - BALL_SIZE.height
+    y = (ball_y + movement_y * frames) % (2 * span)
+    return span - abs(y - span)
+
+
+class CPUController():
+    """Computer player for one bat, moving it to where the ball will arrive
+
+    - The arrival height is only worked out again when the movement of the
+      ball changed, after a bounce or a reset
+    - reaction_delay is the number of frames before it reacts to such a
+      change, error is the most pixels its aim is off
+    - While the ball moves away, the bat goes back to the middle
+    """
+
+    def __init__(self, reaction_delay=0, error=0, seed=None):
+        self.reaction_delay = reaction_delay
+        self.error = error
+        self.rng = Random(seed)
+        self.movement = None
+        self.target = MIDDLE.y
+        self.pending = None  # (frame, target) that becomes the target after the reaction delay
+
+    def __call__(self, match, bat):
+        ball = match.ball
+        if ball.movement != self.movement:
+            self.movement = pg.math.Vector2(ball.movement)
+            self.pending = (match.frame + self.reaction_delay, self.predict(ball, bat))
+        if self.pending is not None and match.frame >= self.pending[0]:
+            self.target = self.pending[1]
+            self.pending = None
+
+        offset = self.target - bat.rect.centery
+        return offset < -BAT_SPEED / 2, offset > BAT_SPEED / 2
+
+    def predict(self, ball, bat):
+        """Return the height the center of the bat should move to"""
+        dx, dy = ball.movement
+        if bat.rect.centerx < MIDDLE.x:
+            edge_x, face_x = ball.position.x, bat.rect.right
+        else:
+            edge_x, face_x = ball.position.x + BALL_SIZE.width, bat.rect.left
+        if dx == 0 or (face_x - edge_x) / dx < 0:
+            return MIDDLE.y
+        y = intercept_y(edge_x, ball.position.y, dx, dy, face_x)
+        return y + BALL_SIZE.height / 2 + self.rng.uniform(-self.error, self.error)
+
+
+def simulate(frames, left=idle, right=idle, match=None):
+    """Run a match for a number of frames without window or frame cap
+
+    - left and right are controllers: callables taking (match, bat) and
+      returning the (up, down) keys to hold for that frame
+    - Return the match, so the scoreboard and sprites can be inspected
+    """
+    if match is None:
+        match = Match()
+    for _ in range(frames):
+        left_up, left_down = left(match, match.bat_left)
+        right_up, right_down = right(match, match.bat_right)
+        match.step(left_up, left_down, right_up, right_down)
+    return match
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description=GAME_TITLE)
+    parser.add_argument("--headless", type=int, metavar="FRAMES",
+        help="simulate FRAMES frames of two ball-following bots without a window and print the score")
+    parser.add_argument("--cpu", choices=DIFFICULTIES, help="let the computer play the right bat at this difficulty")
+    add_common_arguments(parser)
+    return parser
+
+
+def main(args=None, screen=None, started=None):
+    """Play pong in a window until it is closed or ESCAPE is pressed, return True if it was closed
+
+    With args.cpu set to a difficulty the computer plays the right bat.
+    """
+    args = args if args is not None else make_parser().parse_args([])
+    loop = open_game(args, SCREEN_SIZE, GAME_TITLE, BLACK, "pong", screen=screen, started=started)
+    screen, background = loop.screen, loop.background
+    pg.mouse.set_visible(False)
+
+    match = Match()
+    cpu_player = CPUController(**DIFFICULTIES[args.cpu]) if args.cpu is not None else None
+
+    def read_inputs(keys):
+        inputs = (keys[pg.K_w], keys[pg.K_s], keys[pg.K_UP], keys[pg.K_DOWN])
+        if cpu_player is not None:
+            inputs = (*inputs[:2], *cpu_player(match, match.bat_right))
+        return inputs
+
+    return loop.run(
+        match.step,
+        read_inputs,
+        draw=lambda alpha: match.draw(screen, background, alpha),
+        draw_dirty=lambda alpha: match.draw_dirty(loop.renderer, alpha),
+        stats=lambda: {"sprites": len(match.allsprites)},
+    )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = make_parser().parse_args()
+
+    if args.headless is not None:
+        match = simulate(args.headless, left=follow_ball, right=follow_ball)
+        print(f"{match.scoreboard.score_left} : {match.scoreboard.score_right}")
+    else:
+        main(args)
@@ -0,0 +1,274 @@
+"""Gym-style environments that step many games at once, e.g. for reinforcement learning
+
+Every environment has reset() and step(actions) working on N games at
+once. Actions are integer arrays with one entry per game. Observations
+are float32 state vectors, plus pixels if asked for.
+
+Pixel observations are NumPy views of one pygame surface that holds a
+tile for every game, taken with pg.surfarray.pixels2d or pixels3d.
+They are overwritten by the next step, so copy them to keep them.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pygame as pg
+
+import batchpong
+import boxpong
+import pong
+
+STAY, UP, DOWN = 0, 1, 2
+LEFT, RIGHT = UP, DOWN
+
+POINTS_PER_EPISODE = 5  # A pong episode ends when a player has this many points
+MAX_EPISODE_STEPS = 10000
+
+
+class PixelObservations():
+    """Tiles of one surface that games are drawn on as white boxes on black
+
+    - mode "gray" gives (n, height, width) uint8 arrays, "rgb" gives
+      (n, height, width, 3) arrays
+    - Everything is drawn downsample times smaller than on the screen,
+      so there is no scaling afterwards
+    - clear() only erases the boxes drawn since the last clear
+    """
+
+    def __init__(self, n_envs, screen_size, downsample=4, mode="gray"):
+        self.n_envs = n_envs
+        self.downsample = downsample
+        self.width = screen_size[0] // downsample
+        self.height = screen_size[1] // downsample
+
+        if mode == "gray":
+            self.surface = pg.Surface((self.width, n_envs * self.height), depth=8)
+            self.surface.set_palette([(i, i, i) for i in range(256)])
+            pixels = pg.surfarray.pixels2d(self.surface)
+            self.white = 255
+            self.pixels = pixels.reshape(self.width, n_envs, self.height).transpose(1, 2, 0)
+        elif mode == "rgb":
+            self.surface = pg.Surface((self.width, n_envs * self.height))
+            pixels = pg.surfarray.pixels3d(self.surface)
+            self.white = self.surface.map_rgb(pg.Color("white"))
+            self.pixels = pixels.reshape(self.width, n_envs, self.height, 3).transpose(1, 2, 0, 3)
+        else:
+            raise ValueError(f"unknown pixel mode {mode!r}")
+        self.surface.fill(0)
+        self.drawn = []
+
+    def clear(self):
+        for rect in self.drawn:
+            self.surface.fill(0, rect)
+        self.drawn = []
+
+    def draw_box(self, env, x, y, width, height):
+        """Draw a box given in screen coordinates into the tile of a game"""
+        k = self.downsample
+        left = max(int(x) // k, 0)
+        top = max(int(y) // k, 0)
+        right = min((int(x) + int(width) + k - 1) // k, self.width)
+        bottom = min((int(y) + int(height) + k - 1) // k, self.height)
+        if right > left and bottom > top:
+            self.drawn.append(self.surface.fill(self.white, (left, env * self.height + top, right - left, bottom - top)))
+
+
+class PongEnv():
+    """N pong matches on a BatchPong, the agent plays the left bat
+
+    - Actions are STAY, UP or DOWN
+    - The reward is 1 when the agent scores and -1 when the opponent scores
+    - A match is done when a player reaches POINTS_PER_EPISODE points or
+      after MAX_EPISODE_STEPS steps, and starts over on the next step
+    - opponent(batch) returns the (up, down) arrays of the right bat
+    """
+
+    def __init__(self, n_envs, seed=None, pixels=None, downsample=4, opponent=None):
+        self.n_envs = n_envs
+        self.batch = batchpong.BatchPong(n_envs, seed=seed)
+        self.opponent = opponent if opponent is not None else follow_ball_right
+        self.pixels = PixelObservations(n_envs, pong.SCREEN_SIZE, downsample, pixels) if pixels else None
+        self.state = np.zeros((n_envs, 6), dtype=np.float32)
+        self.steps = np.zeros(n_envs, dtype=np.int64)
+        self.done = np.zeros(n_envs, dtype=bool)
+
+    def reset(self):
+        """Start all matches over, return the observations"""
+        self.batch.reset()
+        self.steps[:] = 0
+        self.done[:] = False
+        return self.observe()
+
+    def step(self, actions):
+        """Advance every match by one frame, return (observations, rewards, dones, info)"""
+        actions = np.asarray(actions)
+        if actions.shape != (self.n_envs,):
+            raise ValueError(f"expected {self.n_envs} actions, got an array of shape {actions.shape}")
+
+        if self.done.any():
+            self.batch.reset(self.done)
+            self.steps[self.done] = 0
+
+        right_up, right_down = self.opponent(self.batch)
+        scored_left, scored_right = self.batch.step(actions == UP, actions == DOWN, right_up, right_down)
+        self.steps += 1
+
+        rewards = scored_left.astype(np.float32) - scored_right
+        self.done = (
+            (self.batch.score_left >= POINTS_PER_EPISODE)
+            | (self.batch.score_right >= POINTS_PER_EPISODE)
+            | (self.steps >= MAX_EPISODE_STEPS)
+        )
+        info = {"score_left": self.batch.score_left.copy(), "score_right": self.batch.score_right.copy()}
+        return self.observe(), rewards, self.done.copy(), info
+
+    def observe(self):
+        """Return the state vectors, and the pixels if the environment has them
+
+        A state vector holds the ball position and speed and the heights of
+        both bats, scaled to about -1 to 1.
+        """
+        batch = self.batch
+        self.state[:, 0] = batch.ball_x / pong.SCREEN_SIZE.width
+        self.state[:, 1] = batch.ball_y / pong.SCREEN_SIZE.height
+        self.state[:, 2] = batch.ball_vx / pong.BALL_SPEED
+        self.state[:, 3] = batch.ball_vy / pong.BALL_SPEED
+        self.state[:, 4] = batch.bat_left_y / pong.SCREEN_SIZE.height
+        self.state[:, 5] = batch.bat_right_y / pong.SCREEN_SIZE.height
+        if self.pixels is None:
+            return self.state
+        return self.state, self.render()
+
+    def render(self):
+        pixels = self.pixels
+        pixels.clear()
+        batch = self.batch
+        rows = zip(np.round(batch.ball_x).tolist(), np.round(batch.ball_y).tolist(),
+            batch.bat_left_y.tolist(), batch.bat_right_y.tolist())
+        for env, (ball_x, ball_y, left_y, right_y) in enumerate(rows):
+            pixels.draw_box(env, ball_x, ball_y, *pong.BALL_SIZE)
+            pixels.draw_box(env, batch.bat_left_x, left_y, *pong.BAT_SIZE)
+            pixels.draw_box(env, batch.bat_right_x, right_y, *pong.BAT_SIZE)
+        return pixels.pixels
+
+
+def follow_ball_right(batch):
+    """Opponent that moves the right bat towards the ball"""
+    left_up, left_down, right_up, right_down = batchpong.follow_ball(batch)
+    return right_up, right_down
+
+
+class BoxPongEnv():
+    """N boxpong games, each a boxpong.Game stepped one after the other
+
+    - Actions are STAY, LEFT or RIGHT
+    - The reward is 1 for every box hit and -1 when the ball is lost
+    - A game is done when the ball is lost or all boxes are hit, and
+      starts over on the next step
+    """
+
+    def __init__(self, n_envs, pixels=None, downsample=4):
+        self.n_envs = n_envs
+        self.games = [None] * n_envs
+        self.pixels = PixelObservations(n_envs, boxpong.SCREEN_SIZE, downsample, pixels) if pixels else None
+        self.state = np.zeros((n_envs, 6 + boxpong.N_ROW * boxpong.N_COL), dtype=np.float32)
+        self.previous_actions = np.zeros(n_envs, dtype=np.int64)
+        self.done = np.zeros(n_envs, dtype=bool)
+
+    def new_game(self):
+        game = boxpong.Game()
+        game.step(launch=True)
+        return game
+
+    def reset(self):
+        """Start all games over, return the observations"""
+        self.games = [self.new_game() for _ in range(self.n_envs)]
+        self.previous_actions[:] = STAY
+        self.done[:] = False
+        return self.observe()
+
+    def step(self, actions):
+        """Advance every game by one frame, return (observations, rewards, dones, info)"""
+        actions = np.asarray(actions)
+        if actions.shape != (self.n_envs,):
+            raise ValueError(f"expected {self.n_envs} actions, got an array of shape {actions.shape}")
+
+        rewards = np.zeros(self.n_envs, dtype=np.float32)
+        for env, (game, action, previous) in enumerate(zip(self.games, actions.tolist(), self.previous_actions.tolist())):
+            if self.done[env]:
+                game = self.games[env] = self.new_game()
+                previous = STAY
+
+            boxes = len(game.allboxes)
+            # Like releasing an arrow key in the game loop, letting go of a direction stops the bat
+            release = previous != STAY and action != previous
+            game.step(left=action == LEFT, right=action == RIGHT, release=release)
+
+            cleared = game.show_menu
+            lost = game.ball.is_outside_screen()
+            rewards[env] = (boxes if cleared else boxes - len(game.allboxes)) - lost
+            self.done[env] = cleared or lost
+        self.previous_actions[:] = actions
+        return self.observe(), rewards, self.done.copy(), {}
+
+    def observe(self):
+        """Return the state vectors, and the pixels if the environment has them
+
+        A state vector holds the ball position and speed, the bat position
+        and speed and whether each box is still there.
+        """
+        for env, game in enumerate(self.games):
+            state = self.state[env]
+            state[0] = game.ball.position.x / boxpong.SCREEN_SIZE.width
+            state[1] = game.ball.position.y / boxpong.SCREEN_SIZE.height
+            state[2] = game.ball.movement.x / boxpong.DEFAULT_BALL_SPEED
+            state[3] = game.ball.movement.y / boxpong.DEFAULT_BALL_SPEED
+            state[4] = game.bat.rect.x / boxpong.SCREEN_SIZE.width
+            state[5] = game.bat.speed / boxpong.MAX_BAT_SPEED
+            state[6:] = [box in game.allboxes for box in game.boxes]
+        if self.pixels is None:
+            return self.state
+        return self.state, self.render()
+
+    def render(self):
+        pixels = self.pixels
+        pixels.clear()
+        for env, game in enumerate(self.games):
+            for sprite in (*game.allboxes, game.ball, game.bat):
+                pixels.draw_box(env, *sprite.rect)
+        return pixels.pixels
+
+
+ENVS = {
+    "pong": PongEnv,
+    "boxpong": BoxPongEnv,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the throughput of the environments with random actions")
+    parser.add_argument("env", choices=ENVS)
+    parser.add_argument("--envs", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--pixels", choices=("gray", "rgb"), help="also return pixel observations")
+    parser.add_argument("--downsample", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    kwargs = {"pixels": args.pixels, "downsample": args.downsample}
+    if args.env == "pong":
+        kwargs["seed"] = args.seed
+    env = ENVS[args.env](args.envs, **kwargs)
+    rng = np.random.default_rng(args.seed)
+
+    env.reset()
+    total_reward = 0.0
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        observations, rewards, dones, info = env.step(rng.integers(0, 3, size=args.envs))
+        total_reward += rewards.sum()
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.envs * args.steps / elapsed:,.0f} environment steps per second")
+    print(f"total reward: {total_reward:g}")
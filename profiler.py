@@ -0,0 +1,117 @@
+import csv
+import json
+import time
+from collections import deque
+
+import pygame as pg
+
+from rendercache import get_font
+
+OVERLAY_TEXT_SIZE = 18
+OVERLAY_REFRESH = 15  # Frames between updates of the overlay text
+OVERLAY_POSITION = (10, 10)
+
+
+class FrameProfiler():
+    """Per-phase frame timings with an on-screen overlay and a log file
+
+    - Call start_frame() at the top of the game loop, mark(phase) after
+      each phase and end_frame(**counts) at the bottom
+    - Timings are in milliseconds, counts are any numbers describing the
+      game state, e.g. the number of sprites on screen
+    - With a log path ending in .csv every frame is written as a CSV row,
+      any other path gets one JSON object per line
+    - A profiler made with enabled=False takes no timings, writes no log
+      and ignores toggle(), the overlay never shows
+    """
+
+    def __init__(self, enabled=True, log_path=None, history=600):
+        self.enabled = enabled
+        self.frame = 0
+        self.timings = {}
+        self.counts = {}
+        self.frame_times = deque(maxlen=history)
+        self.visible = False
+
+        self.log_file = open(log_path, "w", newline="") if log_path else None
+        self.writer = None
+        self.is_csv = bool(log_path) and log_path.endswith(".csv")
+
+        self.font = None
+        self.lines = []
+
+    def start_frame(self):
+        if not self.enabled:
+            return
+        self.timings = {}
+        self.frame_start = self.last_mark = time.perf_counter()
+
+    def mark(self, phase):
+        """Record the time since the previous mark as the duration of a phase"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.timings[phase] = (now - self.last_mark) * 1000
+        self.last_mark = now
+
+    def end_frame(self, **counts):
+        if not self.enabled:
+            return
+        frame_time = (self.last_mark - self.frame_start) * 1000
+        self.frame_times.append(frame_time)
+        self.counts = counts
+
+        if self.log_file is not None:
+            row = {"frame": self.frame, "time": round(frame_time, 3)}
+            row.update((phase, round(value, 3)) for phase, value in self.timings.items())
+            row.update(counts)
+            self.write(row)
+
+        if self.visible and self.frame % OVERLAY_REFRESH == 0:
+            self.lines = []
+        self.frame += 1
+
+    def write(self, row):
+        if not self.is_csv:
+            self.log_file.write(json.dumps(row) + "\n")
+            return
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.log_file, fieldnames=list(row))
+            self.writer.writeheader()
+        self.writer.writerow(row)
+
+    def percentiles(self, *percents):
+        """Return percentiles of the recent frame times"""
+        frame_times = sorted(self.frame_times)
+        if not frame_times:
+            return [0.0 for _ in percents]
+        return [frame_times[min(int(len(frame_times) * p / 100), len(frame_times) - 1)] for p in percents]
+
+    def toggle(self):
+        if not self.enabled:
+            return
+        self.visible = not self.visible
+        self.lines = []
+
+    def draw(self, surface):
+        """Draw the overlay if it is visible, the text is only rendered every few frames"""
+        if not self.enabled or not self.visible:
+            return
+        if not self.lines:
+            if self.font is None:
+                self.font = get_font("monospace", OVERLAY_TEXT_SIZE)
+            p50, p95, p99 = self.percentiles(50, 95, 99)
+            texts = [f"frame p50 {p50:5.1f}  p95 {p95:5.1f}  p99 {p99:5.1f} ms"]
+            texts += [f"{phase:<8}{value:6.2f} ms" for phase, value in self.timings.items()]
+            texts += [f"{name:<8}{value:6}" for name, value in self.counts.items()]
+            self.lines = [self.font.render(text, True, pg.Color("yellow"), pg.Color("black")) for text in texts]
+
+        x, y = OVERLAY_POSITION
+        for line in self.lines:
+            surface.blit(line, (x, y))
+            y += line.get_height()
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
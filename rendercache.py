@@ -0,0 +1,89 @@
+import functools
+from collections import OrderedDict
+
+import pygame as pg
+
+TEXT_CACHE_SIZE = 256
+ROTATION_CACHE_SIZE = 64
+
+
+class LRUCache():
+    """Dict-like cache that drops the least recently used entry when full"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, create):
+        """Return the entry for a key, calling create() to make it on a miss"""
+        try:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        except KeyError:
+            value = self.entries[key] = create()
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            return value
+
+    def clear(self):
+        self.entries.clear()
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(name, size, bold=False, italic=False):
+    """Return a system font, only looked up the first time it is asked for"""
+    return pg.font.SysFont(name, size, bold=bold, italic=italic)
+
+
+text_cache = LRUCache(TEXT_CACHE_SIZE)
+
+
+def render_text(text, font, color, background=None, antialias=True):
+    """Return text rendered with a font, reusing the surface when the same text was rendered before"""
+    key = (text, font, antialias, tuple(color), None if background is None else tuple(background))
+    return text_cache.get(key, lambda: font.render(text, antialias, color, background))
+
+
+def prepare_surface(surface, colorkey=None):
+    """Set up a surface that is shared by many sprites
+
+    It is converted to the display format once a display exists, and
+    pixels of the colorkey are skipped when blitting, so the corners of
+    round images do not paint over their neighbors.
+    """
+    if pg.display.get_init() and pg.display.get_surface() is not None:
+        surface = surface.convert()
+    if colorkey is not None:
+        surface.set_colorkey(colorkey, pg.RLEACCEL)
+    return surface
+
+
+def blit_all(target, blits):
+    """Blit a sequence of (surface, position) or (surface, position, area) in one call
+
+    Surface.fblits of pygame-ce would be a little faster, but it takes no area.
+    """
+    target.blits(blits, doreturn=False)
+
+
+class RotationAtlas():
+    """Rotated copies of an image
+
+    The given angles are rotated up front, any other angle is rotated on
+    first use and kept in a small LRU cache.
+    """
+
+    def __init__(self, image, angles=()):
+        self.image = image
+        self.atlas = {angle: pg.transform.rotate(image, angle) for angle in angles}
+        self.cache = LRUCache(ROTATION_CACHE_SIZE)
+
+    def get(self, angle):
+        """Return the image rotated counterclockwise by an angle in degrees"""
+        rotated = self.atlas.get(angle)
+        if rotated is None:
+            rotated = self.cache.get(angle, lambda: pg.transform.rotate(self.image, angle))
+        return rotated
@@ -0,0 +1,260 @@
+"""Where a colorpong shot lands for every nozzle angle, and how many balls it clears
+
+- The path of a shot does not depend on the board, so the paths at all
+  angles are traced once, frame by frame like Ball.move, bouncing off
+  the side walls
+- The cells each path overlaps are found once too, with the frame of
+  the first overlap, so for a board one NumPy pass over them gives the
+  frame each shot first touches a ball
+- A landing cell is scored by the balls the shot removes: the cluster
+  of its color and the balls that hang free once the cluster is gone
+- Plans are kept until the board changes, so asking again every frame
+  while the nozzle turns costs a dictionary lookup
+"""
+
+import argparse
+import functools
+import random
+import time
+from collections import namedtuple
+
+import numpy as np
+import pygame as pg
+
+from colorpong import (BALL_COLORS, BALL_SIZE, DEFAULT_BALL_SPEED, EMPTY, MARGIN, NOZZLE_ANGLES, NOZZLE_MAX_ROTATION,
+    NOZZLE_POSITION, NOZZLE_RADIAL_SPEED, SCREEN_SIZE, Game)
+
+ANGLES = list(NOZZLE_ANGLES)
+
+PATH_COLOR = pg.Color("gray60")
+BEST_COLOR = pg.Color("white")
+
+# removed: balls the shot clears, neighbors: balls of its color next to the landing cell,
+# cells: landing (row, col), frames: frames until the shot lands, hits: False for shots that reach the top
+Plan = namedtuple("Plan", "removed neighbors cells frames hits")
+
+
+@functools.lru_cache(maxsize=None)
+def get_paths():
+    """Return the top-left corners of the ball rect after every frame of a shot at each angle
+
+    Returns (x, y, length): x and y have a row per angle of ANGLES,
+    padded with the last position, length is the number of frames of each
+    path. A path ends at the frame the ball reaches the top margin.
+    """
+    paths = []
+    for angle in ANGLES:
+        rect = pg.Rect((0, 0), BALL_SIZE)
+        rect.center = NOZZLE_POSITION
+        movement = pg.math.Vector2(0, -DEFAULT_BALL_SPEED).rotate(-angle)
+        path = []
+        while True:
+            if rect.right >= SCREEN_SIZE.width or rect.left <= MARGIN:
+                movement.x = -movement.x
+            # move_ip truncates, so the path is traced with rects instead of worked out from the angle
+            rect.move_ip(movement.x, movement.y)
+            path.append(rect.topleft)
+            if rect.top <= MARGIN:
+                break
+        paths.append(path)
+
+    length = np.array([len(path) for path in paths])
+    x = np.empty((len(paths), length.max()), dtype=np.int64)
+    y = np.empty_like(x)
+    for i, path in enumerate(paths):
+        x[i], y[i] = path[-1]
+        x[i, :len(path)], y[i, :len(path)] = np.array(path).T
+    return x, y, length
+
+
+def get_reachable(rotation):
+    """Return the angles the nozzle can turn to from a rotation without turning to a limit first"""
+    steps = range(-2 * NOZZLE_MAX_ROTATION // NOZZLE_RADIAL_SPEED - 1, 2 * NOZZLE_MAX_ROTATION // NOZZLE_RADIAL_SPEED + 2)
+    return sorted({max(-NOZZLE_MAX_ROTATION, min(rotation + n * NOZZLE_RADIAL_SPEED, NOZZLE_MAX_ROTATION)) for n in steps})
+
+
+class ShotPlanner():
+    """Plans shots on one BallGrid
+
+    plan(color_code) returns the Plan of a ball of that color for every
+    angle of ANGLES, best_angle picks the shot to take. Flying balls are
+    not taken into account.
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.plans = {}
+        self.version = None
+
+        # Top-left corner of the ball in every cell
+        n_rows, n_columns = grid.n_rows, grid.n_columns
+        cell_left = np.empty((n_rows, n_columns), dtype=np.int64)
+        cell_top = np.empty_like(cell_left)
+        for (row, col), center in grid.center_points.items():
+            rect = pg.Rect((0, 0), BALL_SIZE)
+            rect.center = center
+            cell_left[row, col], cell_top[row, col] = rect.topleft
+
+        # Every cell whose ball would overlap a shot, with the first frame of the overlap,
+        # grouped by angle and sorted by cell
+        self.x, self.y, self.length = get_paths()
+        n_angles, n_frames = self.x.shape
+        w, h = BALL_SIZE
+        pairs = []
+        for row_offset in (0, 1):
+            row = (self.y - cell_top[0, 0]) // h + row_offset
+            row_inside = (row >= 0) & (row < n_rows)
+            row = row.clip(0, n_rows - 1)
+            for col_offset in (0, 1):
+                col = (self.x - cell_left[row, 0]) // w + col_offset
+                inside = row_inside & (col >= 0) & (col < n_columns)
+                col = col.clip(0, n_columns - 1)
+                overlap = (abs(cell_left[row, col] - self.x) < w) & (abs(cell_top[row, col] - self.y) < h)
+                angle, frame = np.nonzero(inside & overlap & (np.arange(n_frames) < self.length[:, None]))
+                pairs.append((angle, (row * n_columns + col)[angle, frame], frame))
+        angle, cell, frame = (np.concatenate(a) for a in zip(*pairs))
+        key = angle * n_rows * n_columns + cell
+        order = np.lexsort((frame, key))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = key[order][1:] != key[order][:-1]
+        order = order[first]
+        self.cell, self.frame = cell[order], frame[order]
+        # Every path ends at the top, among the cells of row 0, so no angle has an empty group
+        self.starts = np.searchsorted(angle[order], np.arange(n_angles))
+
+    def plan(self, color_code):
+        """Return the Plan for a ball of a color, from the cache while the board is unchanged"""
+        if self.version != self.grid.version:
+            self.plans.clear()
+            self.version = self.grid.version
+        if color_code not in self.plans:
+            self.plans[color_code] = self.make_plan(color_code)
+        return self.plans[color_code]
+
+    def make_plan(self, color_code):
+        grid = self.grid
+        contact = np.where(grid.colors.ravel()[self.cell] != EMPTY, self.frame, self.x.shape[1])
+        frames = np.minimum.reduceat(contact, self.starts)
+        hits = frames < self.length
+        frames = np.minimum(frames, self.length - 1)
+
+        w, h = BALL_SIZE
+        x = self.x[np.arange(len(frames)), frames] + w // 2
+        y = self.y[np.arange(len(frames)), frames] + h // 2
+        # Neighboring angles often land in the same cell
+        outcomes = {}
+        cells = []
+        for center, hit in zip(zip(x.tolist(), y.tolist()), hits.tolist()):
+            cell = grid.get_nearest_free_space(*center)
+            if (cell, hit) not in outcomes:
+                outcomes[(cell, hit)] = self.score(cell, color_code, hit)
+            cells.append(cell)
+        removed, neighbors = zip(*(outcomes[(cell, hit)] for cell, hit in zip(cells, hits.tolist())))
+        return Plan(np.array(removed), np.array(neighbors), cells, frames + 1, hits)
+
+    def score(self, cell, color_code, hit):
+        """Return (balls removed, neighbors of the same color) of a ball landing in a cell
+
+        Like BallGrid.add_ball_hit, a cluster only clears when the ball hits
+        another ball, a ball that reaches the top stays where it lands.
+        """
+        grid = self.grid
+        if cell is None:
+            return 0, 0
+        neighbors = sum(grid.colors[key] == color_code for key in grid.get_neighbors(*cell))
+        if not hit:
+            return 0, neighbors
+
+        cluster = {key for key, ball in grid.get_adjacent_matches(*cell, BALL_COLORS[color_code], {cell})}
+        if len(cluster) < 2:
+            return 0, neighbors
+
+        # Balls still hanging from the top row once the cluster is gone
+        attached = {key for key in grid.matrix if key[0] == 0 and key not in cluster}
+        stack = list(attached)
+        while stack:
+            for key in grid.get_neighbors(*stack.pop()):
+                if key in grid.matrix and key not in cluster and key not in attached:
+                    attached.add(key)
+                    stack.append(key)
+        return len(grid.matrix) - len(attached), neighbors
+
+    def best_angle(self, color_code, rotation=0):
+        """Return the angle reachable from a rotation that removes the most balls
+
+        Ties go to the shot next to the most balls of its color, then to the
+        angle closest to the rotation, so the nozzle turns as little as possible.
+        """
+        plan = self.plan(color_code)
+        def rank(angle):
+            i = angle + NOZZLE_MAX_ROTATION
+            return plan.removed[i], plan.neighbors[i], -abs(angle - rotation)
+        return max(get_reachable(rotation), key=rank)
+
+    def get_path(self, color_code, angle):
+        """Return the centers of the ball on its way to the landing cell of a shot at an angle of ANGLES"""
+        i = angle + NOZZLE_MAX_ROTATION
+        end = self.plan(color_code).frames[i]
+        w, h = BALL_SIZE
+        return list(zip((self.x[i, :end] + w // 2).tolist(), (self.y[i, :end] + h // 2).tolist()))
+
+    def draw(self, screen, color_code, rotation):
+        """Draw the path and landing cell of a shot at the rotation, and the landing cell of the best shot"""
+        plan = self.plan(color_code)
+        path = [NOZZLE_POSITION, *self.get_path(color_code, rotation)]
+        pg.draw.lines(screen, PATH_COLOR, False, path)
+        radius = BALL_SIZE.width // 2
+        cell = plan.cells[rotation + NOZZLE_MAX_ROTATION]
+        if cell is not None:
+            pg.draw.circle(screen, BALL_COLORS[color_code], self.grid.center_points[cell], radius, 2)
+        best = plan.cells[self.best_angle(color_code, rotation) + NOZZLE_MAX_ROTATION]
+        if best is not None and best != cell:
+            pg.draw.circle(screen, BEST_COLOR, self.grid.center_points[best], radius, 1)
+
+
+class CPUPlayer():
+    """Colorpong player that turns the nozzle to the best shot of a ShotPlanner and shoots
+
+    It is called with a Game and returns its (left, right, shoot) inputs.
+    It only shoots once the last shot has landed, as the planner does not
+    see flying balls.
+    """
+
+    def __init__(self, planner):
+        self.planner = planner
+
+    def __call__(self, game):
+        rotation = game.nozzle.rotation
+        target = self.planner.best_angle(game.active_ball.color_code, rotation)
+        if target != rotation:
+            return target > rotation, target < rotation, False
+        return False, False, not game.balls
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Let the CPU player play colorpong without a window and time the shot planner")
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    start = time.perf_counter()
+    get_paths()
+    print(f"paths traced in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    game = Game()
+    planner = ShotPlanner(game.ball_grid)
+    cpu = CPUPlayer(planner)
+    times = []
+    shots = 0
+    for _ in range(args.frames):
+        if planner.version != game.ball_grid.version or game.active_ball.color_code not in planner.plans:
+            start = time.perf_counter()
+            planner.plan(game.active_ball.color_code)
+            times.append(time.perf_counter() - start)
+        left, right, shoot = cpu(game)
+        shots += shoot
+        game.step(left, right, shoot)
+    times.sort()
+    print(f"{shots} shots, {len(game.ball_grid.matrix)} balls left")
+    print(f"{len(times)} plans: median {times[len(times) // 2] * 1000:.2f} ms, max {times[-1] * 1000:.2f} ms")
@@ -0,0 +1,214 @@
+"""Swept collision of axis-aligned boxes, so fast balls can not tunnel through thin bats or bricks"""
+
+from collections import namedtuple
+
+import numpy as np
+
+INFINITY = float("inf")
+
+# A fixed target, unpacked much faster than a pg.Rect, e.g. for walls that are swept every frame
+Box = namedtuple("Box", "x y width height")
+
+
+def _axis_times(position, size, speed, target_position, target_size):
+    """Return when a moving interval starts and stops overlapping a fixed one"""
+    if speed > 0:
+        return (target_position - (position + size)) / speed, (target_position + target_size - position) / speed
+    elif speed < 0:
+        return (target_position + target_size - position) / speed, (target_position - (position + size)) / speed
+    elif position + size <= target_position or position >= target_position + target_size:
+        return INFINITY, -INFINITY
+    return -INFINITY, INFINITY
+
+
+def _sign(value):
+    return (value > 0) - (value < 0)
+
+
+def sweep(box, movement, target):
+    """Return (time, normal) of the first contact of a moving box with a target, or None
+
+    - time is the fraction of movement covered before the contact, from 0 to 1
+    - normal is the side of the target that was hit, e.g. (0, -1) for its top
+      and (-1, -1) for its top-left corner
+    - A box that already overlaps the target counts as a contact at time 0
+      if it moves further into the target along the shallowest axis
+    """
+    x, y, width, height = box
+    dx, dy = movement
+    tx, ty, t_width, t_height = target
+
+    overlap_x = min(x + width, tx + t_width) - max(x, tx)
+    overlap_y = min(y + height, ty + t_height) - max(y, ty)
+    if overlap_x > 0 and overlap_y > 0:
+        if overlap_x < overlap_y:
+            normal = (_sign((x + width / 2) - (tx + t_width / 2)) or -_sign(dx), 0)
+        else:
+            normal = (0, _sign((y + height / 2) - (ty + t_height / 2)) or -_sign(dy))
+        if dx * normal[0] + dy * normal[1] < 0:
+            return 0.0, normal
+        return None
+
+    entry_x, exit_x = _axis_times(x, width, dx, tx, t_width)
+    entry_y, exit_y = _axis_times(y, height, dy, ty, t_height)
+    entry = max(entry_x, entry_y)
+    if entry >= min(exit_x, exit_y) or entry < 0 or entry > 1:
+        return None
+
+    if entry_x > entry_y:
+        normal = (-_sign(dx), 0)
+    elif entry_y > entry_x:
+        normal = (0, -_sign(dy))
+    else:
+        normal = (-_sign(dx), -_sign(dy))
+    return entry, normal
+
+
+def first_contact(box, movement, targets):
+    """Return (time, normal, target) of the earliest contact with any of the targets, or None
+
+    - Targets may be boxes or objects with a rect attribute (such as sprites)
+    - Only targets touching the area the box sweeps through are swept,
+      the others can not be hit, so most frames need no sweep() at all
+    """
+    x, y, width, height = box
+    dx, dy = movement
+    left, right = (x + dx, x + width) if dx < 0 else (x, x + dx + width)
+    top, bottom = (y + dy, y + height) if dy < 0 else (y, y + dy + height)
+    first = None
+    for target in targets:
+        rect = getattr(target, "rect", target)
+        tx, ty, t_width, t_height = rect
+        if tx > right or ty > bottom or tx + t_width < left or ty + t_height < top:
+            continue
+        contact = sweep(box, movement, rect)
+        if contact is not None and (first is None or contact[0] < first[0]):
+            first = (contact[0], contact[1], target)
+    return first
+
+
+def reflect(movement, normal):
+    """Return the movement mirrored on the axes of a normal"""
+    dx, dy = movement
+    return (-dx if normal[0] else dx, -dy if normal[1] else dy)
+
+
+def _reflect_response(target, normal, movement):
+    return reflect(movement, normal)
+
+
+def bounce(box, movement, targets, respond=None, max_contacts=4):
+    """Move a box through one frame, bouncing off targets on the way
+
+    - respond(target, normal, movement) returns the movement after a contact,
+      the default reflects it on the normal
+    - After max_contacts contacts the box stops at the last one
+
+    Return the new (x, y), the new movement and a list of the
+    (target, normal) contacts in the order they happened.
+    """
+    x, y, width, height = box
+    if respond is None:
+        respond = _reflect_response
+
+    contacts = []
+    remaining = 1.0
+    for _ in range(max_contacts):
+        displacement = (movement[0] * remaining, movement[1] * remaining)
+        contact = first_contact((x, y, width, height), displacement, targets)
+        if contact is None:
+            return (x + displacement[0], y + displacement[1]), movement, contacts
+
+        time, normal, target = contact
+        x += displacement[0] * time
+        y += displacement[1] * time
+        remaining *= 1 - time
+
+        contacts.append((target, normal))
+        movement = respond(target, normal, movement)
+    return (x, y), movement, contacts
+
+
+def _axis_times_many(position, size, speed, target_position, target_size):
+    outside = (position + size <= target_position) | (position >= target_position + target_size)
+    near = np.where(speed > 0, target_position - (position + size), target_position + target_size - position)
+    far = np.where(speed > 0, target_position + target_size - position, target_position - (position + size))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entry = np.where(speed != 0, near / speed, np.where(outside, np.inf, -np.inf))
+        exit = np.where(speed != 0, far / speed, np.where(outside, -np.inf, np.inf))
+    return entry, exit
+
+
+def sweep_many(x, y, width, height, dx, dy, target_x, target_y, target_width, target_height):
+    """Vectorized sweep() over NumPy arrays that broadcast together
+
+    Return the contact times (infinity where there is none) and the normals.
+    """
+    overlap_x = np.minimum(x + width, target_x + target_width) - np.maximum(x, target_x)
+    overlap_y = np.minimum(y + height, target_y + target_height) - np.maximum(y, target_y)
+    inside = (overlap_x > 0) & (overlap_y > 0)
+    shallow_x = overlap_x < overlap_y
+    side_x = np.sign((x + width / 2) - (target_x + target_width / 2))
+    side_y = np.sign((y + height / 2) - (target_y + target_height / 2))
+    inside_nx = np.where(shallow_x, np.where(side_x != 0, side_x, -np.sign(dx)), 0)
+    inside_ny = np.where(shallow_x, 0, np.where(side_y != 0, side_y, -np.sign(dy)))
+    inside_hit = inside & (dx * inside_nx + dy * inside_ny < 0)
+
+    entry_x, exit_x = _axis_times_many(x, width, dx, target_x, target_width)
+    entry_y, exit_y = _axis_times_many(y, height, dy, target_y, target_height)
+    entry = np.maximum(entry_x, entry_y)
+    hit = ~inside & (entry < np.minimum(exit_x, exit_y)) & (entry >= 0) & (entry <= 1)
+
+    nx = np.where(entry_x >= entry_y, -np.sign(dx), 0)
+    ny = np.where(entry_y >= entry_x, -np.sign(dy), 0)
+
+    time = np.where(inside_hit, 0.0, np.where(hit, entry, np.inf))
+    return time, np.where(inside, inside_nx, nx), np.where(inside, inside_ny, ny)
+
+
+def bounce_many(x, y, width, height, vx, vy, targets, respond=None, max_contacts=4):
+    """Vectorized bounce() of many boxes of the same size, updating the arrays in place
+
+    - x, y, vx and vy are float arrays with one entry per box
+    - targets is a (x, y, width, height) tuple of arrays, either of shape
+      (n_targets,) shared by all boxes or (n_boxes, n_targets)
+    - Every contact reflects the movement on its normal, then
+      respond(index, target, nx, ny) is called with arrays of the boxes
+      that made contact in this round and may further change vx, vy and
+      the targets, e.g. move a destroyed brick off the board with an x of
+      infinity. A target of zero size is still hit, like a point
+    """
+    def rows(array, index):
+        return array[index] if np.ndim(array) == 2 else array
+
+    remaining = np.ones(len(x))
+    index = np.arange(len(x))
+    for _ in range(max_contacts):
+        dx = vx[index] * remaining[index]
+        dy = vy[index] * remaining[index]
+        time, nx, ny = sweep_many(
+            x[index, None], y[index, None], width, height, dx[:, None], dy[:, None],
+            *(rows(array, index) for array in targets),
+        )
+        target = np.argmin(time, axis=1)
+        time = time[np.arange(len(index)), target]
+
+        free = np.isinf(time)
+        x[index[free]] += dx[free]
+        y[index[free]] += dy[free]
+
+        contact = ~free
+        if not contact.any():
+            break
+        rows_hit = np.arange(len(index))[contact]
+        target, time = target[contact], time[contact]
+        nx, ny = nx[rows_hit, target], ny[rows_hit, target]
+        index, dx, dy = index[contact], dx[contact], dy[contact]
+
+        x[index] += dx * time
+        y[index] += dy * time
+        remaining[index] *= 1 - time
+        vx[index] = np.where(nx != 0, -vx[index], vx[index])
+        vy[index] = np.where(ny != 0, -vy[index], vy[index])
+        if respond is not None:
+            respond(index, target, nx, ny)
@@ -0,0 +1,4 @@
+import os
+
+# The games make surfaces and fonts, no test opens a real window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
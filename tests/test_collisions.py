@@ -0,0 +1,127 @@
+"""Swept collision edge cases, and BatchPong against pong.Match"""
+
+import random
+import unittest
+
+import numpy as np
+
+import boxpong
+import pong
+import sweep
+from batchpong import BatchPong
+from engine import Position, Size
+
+
+def bounce_many_one(box, movement, targets):
+    """Run bounce_many() for a single box, return the position and movement like bounce()"""
+    x, y, width, height = box
+    xs, ys = np.array([x], dtype=float), np.array([y], dtype=float)
+    vx, vy = np.array([movement[0]], dtype=float), np.array([movement[1]], dtype=float)
+    sweep.bounce_many(xs, ys, width, height, vx, vy, tuple(np.array(column, dtype=float) for column in zip(*targets)))
+    return (xs[0], ys[0]), (vx[0], vy[0])
+
+
+class SweepTest(unittest.TestCase):
+    def test_zero_size_target(self):
+        self.assertEqual(sweep.sweep((0, 0, 10, 10), (20, 0), (15, 5, 0, 0)), (0.25, (-1, 0)))
+        # A point on the edge of the path is not hit
+        self.assertIsNone(sweep.sweep((0, 0, 10, 10), (20, 0), (15, 10, 0, 0)))
+        position, movement, contacts = sweep.bounce((0, 0, 10, 10), (20, 0), [(15, 5, 0, 0)])
+        self.assertEqual((position, movement, len(contacts)), ((-10, 0), (-20, 0), 1))
+        self.assertEqual(bounce_many_one((0, 0, 10, 10), (20, 0), [(15, 5, 0, 0)]), ((-10, 0), (-20, 0)))
+
+    def test_corner_hit(self):
+        self.assertEqual(sweep.sweep((0, 0, 10, 10), (10, 10), (15, 15, 10, 10)), (0.5, (-1, -1)))
+        position, movement, contacts = sweep.bounce((0, 0, 10, 10), (10, 10), [(15, 15, 10, 10)])
+        self.assertEqual((position, movement), ((0, 0), (-10, -10)))
+        self.assertEqual(bounce_many_one((0, 0, 10, 10), (10, 10), [(15, 15, 10, 10)]), ((0, 0), (-10, -10)))
+        # Passing a corner without touching it
+        self.assertIsNone(sweep.sweep((0, 0, 10, 10), (10, 10), (20, 0, 10, 10)))
+
+    def test_simultaneous_contacts(self):
+        # Two targets hit at the same time bounce the box once, off the first one
+        targets = [(20, 0, 10, 5), (20, 5, 10, 5)]
+        self.assertEqual(sweep.first_contact((0, 0, 10, 10), (20, 0), targets), (0.5, (-1, 0), targets[0]))
+        position, movement, contacts = sweep.bounce((0, 0, 10, 10), (20, 0), targets)
+        self.assertEqual((position, movement, contacts), ((0, 0), (-20, 0), [(targets[0], (-1, 0))]))
+        self.assertEqual(bounce_many_one((0, 0, 10, 10), (20, 0), targets), ((0, 0), (-20, 0)))
+        # Two walls hit in the same corner, the box bounces off both
+        position, movement, contacts = sweep.bounce((10, 10, 10, 10), (-20, -20), [(0, 0, 100, 5), (0, 0, 5, 100)])
+        self.assertEqual((position, movement, [normal for _, normal in contacts]), ((20, 20), (20, 20), [(0, 1), (1, 0)]))
+
+    def test_touching_targets(self):
+        # The broad phase must not skip targets that only touch the swept area
+        self.assertEqual(sweep.first_contact((0, 0, 10, 10), (10, 0), [(20, 0, 10, 10)])[:2], (1.0, (-1, 0)))
+        self.assertIsNone(sweep.first_contact((0, 0, 10, 10), (10, 0), [(20, 10, 10, 10)]))
+        self.assertIsNone(sweep.first_contact((0, 0, 10, 10), (10, 0), [(sweep.INFINITY, 0, 10, 10)]))
+
+    def test_vectorized_like_scalar(self):
+        rng = random.Random(0)
+
+        def coordinate():
+            return rng.choice((rng.randint(-20, 20), rng.uniform(-20, 20)))
+
+        for _ in range(20000):
+            box = (coordinate(), coordinate(), rng.randint(0, 10), rng.randint(0, 10))
+            movement = (coordinate(), coordinate())
+            target = (coordinate(), coordinate(), rng.randint(0, 10), rng.randint(0, 10))
+            contact = sweep.sweep(box, movement, target)
+            time, nx, ny = sweep.sweep_many(*box, *movement, *target)
+            if contact is None:
+                self.assertTrue(np.isinf(time), (box, movement, target, time))
+            else:
+                self.assertEqual((float(time), (int(nx), int(ny))), contact, (box, movement, target))
+
+        for _ in range(2000):
+            box = (coordinate(), coordinate(), 8, 8)
+            movement = (coordinate(), coordinate())
+            targets = [(coordinate(), coordinate(), rng.randint(0, 10), rng.randint(0, 10)) for _ in range(4)]
+            position, movement_after, _ = sweep.bounce(box, movement, targets)
+            np.testing.assert_allclose((*position, *movement_after), np.concatenate(bounce_many_one(box, movement, targets)))
+
+
+class MultiBallTest(unittest.TestCase):
+    def test_destroyed_boxes_stay_destroyed(self):
+        # A box one ball breaks is not bounced off by another ball in the same frame, even when it is smaller than a ball
+        big = boxpong.Box(Position(500, 300), size=Size(40, 20))
+        small = boxpong.Box(Position(440, 290), size=Size(20, 20))
+        balls = boxpong.MultiBall()
+        balls.add(np.array([510.0, 470.0]), np.array([330.0, 290.0]), np.array([0.0, -40.0]), np.array([-40.0, 0.0]))
+        hits = balls.move(boxpong.Bat(), boxpong.BoxGroup(big, small))
+        self.assertEqual(set(hits), {big, small})
+        self.assertEqual(balls.x.tolist(), [510.0, 490.0])
+        self.assertEqual(balls.vx.tolist(), [0.0, 40.0])
+
+
+class BatchPongTest(unittest.TestCase):
+    def test_plays_like_match(self):
+        # The serve after a point is random, so a match that scored is copied into the batch again
+        n_matches, frames = 10, 3000
+        random.seed(0)
+        rng = np.random.default_rng(0)
+        matches = [pong.Match() for _ in range(n_matches)]
+        batch = BatchPong(n_matches, seed=0)
+        for index, match in enumerate(matches):
+            batch.load_match(index, match)
+
+        points = 0
+        for frame in range(frames):
+            inputs = rng.random((4, n_matches)) < 0.3
+            scored_left, scored_right = batch.step(*inputs)
+            for index, match in enumerate(matches):
+                scorer = match.step(*(bool(keys[index]) for keys in inputs))
+                expected = (scorer, match.bat_left.rect.y, match.bat_right.rect.y, match.scoreboard.score_left, match.scoreboard.score_right)
+                actual = ("left" if scored_left[index] else "right" if scored_right[index] else None, batch.bat_left_y[index],
+                    batch.bat_right_y[index], batch.score_left[index], batch.score_right[index])
+                if scorer is None:
+                    expected += (*match.ball.position, *match.ball.movement)
+                    actual += (batch.ball_x[index], batch.ball_y[index], batch.ball_vx[index], batch.ball_vy[index])
+                else:
+                    points += 1
+                    batch.load_match(index, match)
+                self.assertEqual(expected, actual, f"frame {frame} match {index}")
+        self.assertGreater(points, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
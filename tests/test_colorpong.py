@@ -0,0 +1,134 @@
+"""The colorpong grid against the straightforward searches it replaced, on fixed grids"""
+
+import math
+import unittest
+
+import colorpong
+from colorpong import BALL_COLORS, Ball, BallGrid
+
+COLOR_CODES = {"R": 0, "B": 1, "G": 2, "Y": 3}  # Letters of the grids below, . is an empty cell
+
+GRIDS = [
+    [
+        "RRBBGGYY",
+        ".RB.G..Y",
+        "..RR..YY",
+        "...R....",
+    ],
+    [
+        "RGRGRGRG",
+        "R......G",
+        "RRRRRRRR",
+        ".B.B.B.B",
+        "BBBB....",
+    ],
+    # Clusters that hang from nothing
+    [
+        "........RRRR",
+        "B.......R...",
+        "BB......RB..",
+        ".BB.........",
+        "..BBB..BBB..",
+        "......GG.G..",
+    ],
+]
+
+
+def make_grid(rows):
+    grid = BallGrid()
+    for key in list(grid.matrix):
+        grid.remove(*key)
+    for row, line in enumerate(rows):
+        for col, letter in enumerate(line):
+            if letter != ".":
+                grid.place(row, col, Ball(grid.center_points[(row, col)], BALL_COLORS[COLOR_CODES[letter]]))
+    return grid
+
+
+def reference_matches(grid, row, col, color, seen):
+    """The recursive search of the first colorpong, returning the matched cells"""
+    matches = set()
+    for key in grid.get_neighbors(row, col):
+        ball = grid.matrix.get(key)
+        if ball is not None and (color is None or ball.color == color) and key not in seen:
+            matches.add(key)
+            seen.add(key)
+            matches |= reference_matches(grid, key[0], key[1], color, seen)
+    return matches
+
+
+def reference_attached(grid):
+    """Return the cells connected to the top row, found from every ball of the top row"""
+    attached = set()
+    for key in grid.matrix:
+        if key[0] == 0:
+            attached.add(key)
+            attached |= reference_matches(grid, key[0], key[1], None, {key})
+    return attached
+
+
+def reference_nearest(grid, x, y):
+    """Return the free cell closest to a point by looking at every cell"""
+    nearest = None
+    min_distance = 1E6
+    for key, (cx, cy) in grid.center_points.items():
+        if key not in grid.matrix:
+            distance = math.hypot(x - cx, y - cy)
+            if distance < min_distance:
+                nearest = key
+                min_distance = distance
+    return nearest
+
+
+class BallGridTest(unittest.TestCase):
+    def test_adjacent_matches(self):
+        for rows in GRIDS:
+            grid = make_grid(rows)
+            for row in range(len(rows) + 1):
+                for col in range(len(rows[0]) + 1):
+                    for color in (*BALL_COLORS[:4], None):
+                        found = grid.get_adjacent_matches(row, col, color, {(row, col)})
+                        self.assertEqual({key for key, _ in found}, reference_matches(grid, row, col, color, {(row, col)}),
+                            (rows, row, col, color))
+
+    def test_delete_hanging_balls(self):
+        for rows in GRIDS:
+            grid = make_grid(rows)
+            expected = reference_attached(grid)
+            grid.delete_hanging_balls()
+            self.assertEqual(set(grid.matrix), expected, rows)
+
+    def test_add_ball_hit(self):
+        # Every free cell next to a ball is hit with every color, the grid must end up like the first colorpong's
+        for rows in GRIDS:
+            start = make_grid(rows)
+            start.delete_hanging_balls()
+            cells = sorted({n for key in start.matrix for n in start.get_neighbors(*key) if n not in start.matrix})
+            for row, col in cells:
+                for color in BALL_COLORS[:4]:
+                    grid = make_grid(rows)
+                    grid.delete_hanging_balls()
+                    matches = reference_matches(grid, row, col, color, {(row, col)})
+
+                    grid.add_ball_hit(Ball((0, 0), color), row, col)
+
+                    expected = set(start.matrix) | {(row, col)} if len(matches) < 2 else set(start.matrix) - matches
+                    reference = make_grid([])
+                    for key in expected:
+                        reference.place(*key, Ball(reference.center_points[key], BALL_COLORS[0]))
+                    self.assertEqual(set(grid.matrix), reference_attached(reference), (rows, row, col, color))
+                    self.assertEqual({key for key in zip(*(grid.colors != colorpong.EMPTY).nonzero())}, set(grid.matrix))
+
+    def test_nearest_free_space(self):
+        for rows in GRIDS:
+            grid = make_grid(rows)
+            for x in range(-40, colorpong.SCREEN_SIZE.width + 40, 23):
+                for y in range(-40, 400, 17):
+                    self.assertEqual(grid.get_nearest_free_space(x, y), reference_nearest(grid, x, y), (rows, x, y))
+            for key, (x, y) in grid.center_points.items():
+                if key[0] < len(rows) + 2:
+                    self.assertEqual(grid.get_nearest_free_space(x, y), reference_nearest(grid, x, y), (rows, key))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+"""Level packs only hold levels that boxpong can clear"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from levels import STEEL, LevelPack, make_grid_level, write_pack
+
+
+class WritePackTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "pack.lvl")
+
+    def test_levels(self):
+        steel = make_grid_level((0, 0), 2, 3, (20, 10), 2, box_type=STEEL)
+        mixed = steel.copy()
+        mixed["type"][0] = 0
+        self.assertEqual(write_pack(self.path, [mixed, mixed[:1]]), 2)
+        pack = LevelPack(self.path)
+        self.assertEqual([len(level) for level in pack], [6, 1])
+        np.testing.assert_array_equal(pack[0], mixed)
+
+    def test_unbreakable_levels(self):
+        mixed = make_grid_level((0, 0), 2, 3, (20, 10), 2)
+        for level in (make_grid_level((0, 0), 2, 3, (20, 10), 2, box_type=STEEL), mixed[:0]):
+            with self.assertRaisesRegex(ValueError, "level 1 .* no breakable boxes"):
+                write_pack(self.path, [mixed, level])
+
+
+if __name__ == "__main__":
+    unittest.main()
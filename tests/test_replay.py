@@ -0,0 +1,75 @@
+"""Replays recorded from seeded sessions play back to the same state"""
+
+import importlib
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+
+import boxpong
+import replay
+from levels import generate_level, write_pack
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def record(self, name, options=None, steps=400, seed=1234):
+        """Play a game with random inputs while recording it, return the replay path and the final state"""
+        module_name, class_name, n_inputs = replay.GAMES[name]
+        path = os.path.join(self.directory.name, f"{name}.rep")
+        writer = replay.ReplayWriter(path, name, seed, options)
+        game = getattr(importlib.import_module(module_name), class_name)(**(options or {}))
+        # Not the random module, the game draws from that one
+        rng = random.Random(seed)
+        for _ in range(steps):
+            inputs = tuple(rng.random() < 0.1 for _ in range(n_inputs))
+            writer.record(*inputs)
+            game.step(*inputs)
+        writer.close()
+        state = game.get_state()
+        if getattr(game, "levels", None) is not None:
+            game.levels.close()
+        return path, state
+
+    def play(self, path):
+        loaded = replay.load(path)
+        game = replay.play(loaded)
+        if getattr(game, "levels", None) is not None:
+            game.levels.close()
+        return loaded, game.get_state()
+
+    def test_games(self):
+        for name in replay.GAMES:
+            path, state = self.record(name)
+            loaded, played = self.play(path)
+            self.assertEqual((loaded.game, loaded.seed, len(loaded.inputs), loaded.options), (name, 1234, 400, {}))
+            self.assertEqual(played, state, name)
+
+    def test_options(self):
+        pack = os.path.join(self.directory.name, "pack.lvl")
+        rng = np.random.default_rng(0)
+        area = (boxpong.MARGIN, boxpong.MARGIN, boxpong.SCREEN_SIZE.width - 2 * boxpong.MARGIN, boxpong.SCREEN_SIZE.height // 2)
+        write_pack(pack, (generate_level(rng, area, boxpong.BOX_SIZE, boxpong.BOX_PADDING, 0.3) for _ in range(4)))
+        options = {"levels": pack, "start_level": 2}
+
+        path, state = self.record("boxpong", options)
+        loaded, played = self.play(path)
+        self.assertEqual(loaded.options, options)
+        self.assertEqual(played, state)
+
+    def test_version_1(self):
+        # Files written before the options were added have none
+        path = os.path.join(self.directory.name, "old.rep")
+        with open(path, "wb") as f:
+            f.write(replay.HEADER.pack(replay.MAGIC, 1, b"pong", 7) + bytes((1, 2, 3)))
+        loaded = replay.load(path)
+        self.assertEqual(loaded, replay.Replay("pong", 7, bytes((1, 2, 3)), {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
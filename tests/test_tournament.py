@@ -0,0 +1,28 @@
+"""Tournament matches are reproducible from their seed"""
+
+import unittest
+
+import pong
+import tournament
+
+
+class NormalCPU(pong.CPUController):
+    """The CPU player at a difficulty that aims with random errors"""
+
+    def __init__(self, seed=None):
+        pong.CPUController.__init__(self, **pong.DIFFICULTIES["normal"], seed=seed)
+
+
+class TournamentTest(unittest.TestCase):
+    def test_matches_repeat(self):
+        bot = f"{__name__}:NormalCPU"
+        job = tournament.make_jobs([bot, bot], points=5, max_frames=60000)[0]
+        first, second = tournament.play_match(job), tournament.play_match(job)
+        for result in (first, second):
+            del result["duration"]
+        self.assertEqual(first, second)
+        self.assertNotEqual(tournament.play_match(dict(job, seed=job["seed"] + 1))["rallies"], first["rallies"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import time
+
+LOGIC_RATE = 60  # Logic steps per second, all speeds in the games are in pixels per step
+MAX_STEPS = 5  # Most logic steps run for one rendered frame, more lag than that is dropped
+MAX_INTERPOLATION = 100  # Sprites that jumped further in one step, like a reset ball, are drawn where they are
+
+
+class FixedTimestep():
+    """Runs the game logic at a fixed rate, however fast frames are rendered
+
+    - Call advance() once per rendered frame and run as many logic steps
+      as it returns, this may be none on fast displays or several after
+      a slow frame
+    - alpha tells how far the render time is between the last two logic
+      steps, from 0 to 1, to draw moving things in between
+    - After a hitch longer than max_steps the game slows down instead of
+      trying to catch up forever
+    """
+
+    def __init__(self, rate=LOGIC_RATE, max_steps=MAX_STEPS):
+        self.step_time = 1 / rate
+        self.max_steps = max_steps
+        self.reset()
+
+    def reset(self):
+        """Forget the time that passed, e.g. after the game was paused"""
+        self.accumulator = 0.0
+        self.last_time = time.perf_counter()
+
+    def advance(self):
+        """Return the number of logic steps that are due since the last call"""
+        now = time.perf_counter()
+        self.accumulator += now - self.last_time
+        self.last_time = now
+
+        steps = int(self.accumulator / self.step_time)
+        if steps > self.max_steps:
+            steps = self.max_steps
+            self.accumulator = self.step_time * steps
+        self.accumulator -= self.step_time * steps
+        return steps
+
+    @property
+    def alpha(self):
+        return min(self.accumulator / self.step_time, 1.0)
+
+
+def snapshot(sprites):
+    """Return the position of every sprite, to be taken before a logic step"""
+    return {sprite: sprite.rect.topleft for sprite in sprites}
+
+
+def interpolate(sprites, previous, alpha):
+    """Return the (image, rect) of sprites drawn between their position in a snapshot and now
+
+    Sprites that are not in the snapshot or jumped too far are drawn at their current position.
+    """
+    blits = []
+    for sprite in sprites:
+        rect = sprite.rect
+        old = previous.get(sprite)
+        if old is not None and alpha < 1:
+            dx, dy = old[0] - rect.x, old[1] - rect.y
+            if abs(dx) + abs(dy) <= MAX_INTERPOLATION:
+                rect = rect.move(round(dx * (1 - alpha)), round(dy * (1 - alpha)))
+        blits.append((sprite.image, rect))
+    return blits
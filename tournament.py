@@ -0,0 +1,160 @@
+"""Round-robin tournament of pong bots, played on all CPU cores
+
+Bots are controllers as taken by pong.simulate: callables (match, bat)
+returning the (up, down) keys to hold. They are named like the built-in
+bots below or given as "module:function". A class is created once per
+match and side, for controllers that keep state, with a seed keyword
+argument drawn from the match's seed, so bots with random aim play the
+same matches every time.
+
+Every finished match is appended to a JSON lines results file right away.
+Running the same tournament with the same results file again skips the
+matches that are already in it, so an interrupted tournament can resume.
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import time
+
+import pong
+
+BOTS = {
+    "idle": "pong:idle",
+    "follow_ball": "pong:follow_ball",
+    "cpu": "pong:CPUController",
+}
+
+POINTS_TO_WIN = 11
+MAX_FRAMES = 60 * 60 * 10  # Ten minutes of game time, matches of bots that never miss end in a draw
+
+
+def load_bot(name, seed=None):
+    """Return the controller of a built-in bot name or a "module:function" path, classes are made with the seed"""
+    module_name, function_name = BOTS.get(name, name).split(":")
+    bot = getattr(importlib.import_module(module_name), function_name)
+    return bot(seed=seed) if isinstance(bot, type) else bot
+
+
+def make_jobs(bots, rounds=1, seed=0, points=POINTS_TO_WIN, max_frames=MAX_FRAMES):
+    """Return a job for every match: each bot plays each other bot on both sides, rounds times"""
+    jobs = []
+    for round_ in range(rounds):
+        for left, right in itertools.permutations(bots, 2):
+            jobs.append({
+                "id": f"{left}|{right}|{round_}",
+                "left": left,
+                "right": right,
+                "seed": seed * 1000003 + len(jobs),
+                "points": points,
+                "max_frames": max_frames,
+            })
+    return jobs
+
+
+def play_match(job):
+    """Play one match of a job and return its result"""
+    random.seed(job["seed"])
+    left, right = load_bot(job["left"], seed=2 * job["seed"]), load_bot(job["right"], seed=2 * job["seed"] + 1)
+    match = pong.Match()
+
+    rallies = []
+    hits = 0
+    start = time.perf_counter()
+    scoreboard = match.scoreboard
+    while match.frame < job["max_frames"] and max(scoreboard.score_left, scoreboard.score_right) < job["points"]:
+        left_up, left_down = left(match, match.bat_left)
+        right_up, right_down = right(match, match.bat_right)
+        if match.step(left_up, left_down, right_up, right_down) is not None:
+            rallies.append(hits)
+            hits = 0
+        hits += sum(isinstance(target, pong.Bat) for target, normal in match.contacts)
+
+    return {
+        "id": job["id"],
+        "left": job["left"],
+        "right": job["right"],
+        "score_left": scoreboard.score_left,
+        "score_right": scoreboard.score_right,
+        "frames": match.frame,
+        "rallies": rallies,
+        "duration": round(time.perf_counter() - start, 3),
+    }
+
+
+def read_results(path):
+    """Return the results in a results file, cutting off a line left incomplete by an interruption"""
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    return [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+
+
+def run(jobs, path, workers=None):
+    """Play every job that has no result in the results file yet, appending results as they come in
+
+    Return all results, the old and the new ones.
+    """
+    results = read_results(path)
+    done = {result["id"] for result in results}
+    todo = [job for job in jobs if job["id"] not in done]
+    if done:
+        print(f"resuming: {len(done)} matches done, {len(todo)} to play")
+
+    with open(path, "a") as f, multiprocessing.Pool(workers) as pool:
+        for result in pool.imap_unordered(play_match, todo):
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+            results.append(result)
+            print(f"{len(results)}/{len(jobs)} {result['left']} {result['score_left']} : {result['score_right']} {result['right']}")
+    return results
+
+
+def standings(results):
+    """Return (bot, wins, draws, losses, points for, points against, mean rally) rows, best first"""
+    table = {}
+    rallies = {}
+    for result in results:
+        for side, other in (("left", "right"), ("right", "left")):
+            bot = result[side]
+            row = table.setdefault(bot, [0, 0, 0, 0, 0])
+            scored, conceded = result[f"score_{side}"], result[f"score_{other}"]
+            row[0 if scored > conceded else 1 if scored == conceded else 2] += 1
+            row[3] += scored
+            row[4] += conceded
+            rallies.setdefault(bot, []).extend(result["rallies"])
+    rows = [(bot, *row, sum(rallies[bot]) / max(len(rallies[bot]), 1)) for bot, row in table.items()]
+    return sorted(rows, key=lambda row: (-row[1], -row[2], row[5] - row[4]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play every pong bot against every other on all CPU cores")
+    parser.add_argument("results", help="JSON lines file the results are appended to, an existing one is resumed")
+    parser.add_argument("--bots", nargs="+", default=list(BOTS), help=f"built-in bots ({', '.join(BOTS)}) or module:function paths")
+    parser.add_argument("--rounds", type=int, default=1, help="how often every pairing is played on each side")
+    parser.add_argument("--points", type=int, default=POINTS_TO_WIN)
+    parser.add_argument("--max-frames", type=int, default=MAX_FRAMES)
+    parser.add_argument("--workers", type=int, help="number of processes, default one per CPU core")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for bot in args.bots:
+        if bot not in BOTS and ":" not in bot:
+            parser.error(f"unknown bot {bot!r}")
+
+    jobs = make_jobs(args.bots, args.rounds, args.seed, args.points, args.max_frames)
+    start = time.perf_counter()
+    results = run(jobs, args.results, args.workers)
+    print(f"{len(results)} matches in {time.perf_counter() - start:.1f} s")
+
+    ids = {job["id"] for job in jobs}
+    print(f"{'bot':<20} {'won':>4} {'drawn':>5} {'lost':>4} {'for':>5} {'against':>7} {'rally':>6}")
+    for bot, won, drawn, lost, scored, conceded, rally in standings([r for r in results if r["id"] in ids]):
+        print(f"{bot:<20} {won:>4} {drawn:>5} {lost:>4} {scored:>5} {conceded:>7} {rally:>6.1f}")